@@ -0,0 +1,110 @@
+"""
+Generates a synthetic capture tree shaped like the output of PSITREScapture:
+CameraInfo, FC2Version and SystemInfo files of every camera at the root and
+YYYYMMDD/HH directories with an ImageMetadata file and an empty image per
+frame. The first frame of every second lies on the whole second and its
+file names have no fractional seconds, like the ones PSITREScapture writes.
+
+    python -m benchmarks.capture_tree --data_dir /tmp/capture --cameras 2 --fps 15 --hours 2
+"""
+from __future__ import print_function
+from datetime import datetime, timedelta
+import click
+import random
+import os
+
+
+_init_files = {
+    'CameraInfo':'<modelName>Flea3 FL3-U3-13E4C</modelName><vendorName>Point Grey Research</vendorName>'
+                 '<isColorCamera>true</isColorCamera><interfaceType>3</interfaceType><busNumber>{bus}</busNumber>'
+                 '<nodeNumber>0</nodeNumber><maximumBusSpeed>6</maximumBusSpeed>',
+    'FC2Version':'<major>2</major><minor>9</minor><type>3</type><build>57</build>',
+    'SystemInfo':'<osType>2</osType><osDescription>Windows 7</osDescription><byteOrder>0</byteOrder>'
+                 '<sysMemSize>16384</sysMemSize><numCpuCores>8</numCpuCores><screenWidth>1920</screenWidth>'
+                 '<screenHeight>1080</screenHeight>',
+}
+_image_metadata = ('<embeddedTimeStamp>{timeStamp}</embeddedTimeStamp><embeddedGain>{gain}</embeddedGain>'
+                   '<embeddedShutter>{shutter}</embeddedShutter><embeddedBrightness>0</embeddedBrightness>'
+                   '<embeddedExposure>{exposure}</embeddedExposure><embeddedWhiteBalance>0</embeddedWhiteBalance>'
+                   '<embeddedFrameCounter>{frameCounter}</embeddedFrameCounter>')
+
+
+def _stamp(timestamp):
+    if timestamp.microsecond:
+        return timestamp.strftime('%Y%m%dT%H%M%S.%f')
+    return timestamp.strftime('%Y%m%dT%H%M%S')
+
+
+def _write(path, modelName, body):
+    with open(path, 'w') as fp:
+        fp.write('<PSITRES><{0}>{1}</{0}></PSITRES>'.format(modelName, body))
+
+
+default_start = datetime(2017, 5, 1, 10)
+
+
+def serial_numbers(cameras):
+    return [16401200 + i for i in xrange(cameras)]
+
+
+def generate(data_dir, cameras=2, fps=15, hours=1, seconds=60, seperator='_',
+             start=default_start, jitter=3000, drift=0, seed=0):
+    """
+    Writes a capture tree of cameras recording at fps for the first seconds
+    of each of hours consecutive hours from start, with creationTimeStamps
+    delayed by up to jitter microseconds. embeddedTimeStamps are in
+    microseconds of a clock per camera, the i-th of which runs i * drift
+    parts per million fast. Returns the serial numbers of the cameras and
+    the number of metadata files and images written.
+    """
+    rng = random.Random(seed)
+    os.makedirs(data_dir)
+    serials = serial_numbers(cameras)
+    metadata_files, images = 0, 0
+    for bus, serialNumber in enumerate(serials):
+        for modelName, body in sorted(_init_files.iteritems()):
+            fname = seperator.join((_stamp(start - timedelta(seconds=1)), str(serialNumber), modelName)) + '.xml'
+            _write(os.path.join(data_dir, fname), modelName, body.format(bus=bus))
+            metadata_files += 1
+
+    frames_per_hour = int(seconds * fps)
+    for hour in xrange(hours):
+        hour_start = start + timedelta(hours=hour)
+        directory = os.path.join(data_dir, hour_start.strftime('%Y%m%d'), hour_start.strftime('%H'))
+        os.makedirs(directory)
+        for camera, serialNumber in enumerate(serials):
+            for i in xrange(frames_per_hour):
+                offset = i * 10 ** 6 // fps
+                embedded = (hour * 3600 * 10 ** 6 + offset) * (10 ** 6 + camera * drift) // 10 ** 6 + camera * 10 ** 9
+                if offset % 10 ** 6 and jitter:
+                    offset += rng.randrange(jitter)
+                timestamp = hour_start + timedelta(microseconds=offset)
+                frameNumber = hour * frames_per_hour + i
+                prefix = seperator.join((_stamp(timestamp), str(serialNumber)))
+                open(os.path.join(directory, prefix + seperator + str(frameNumber) + '.jpg'), 'w').close()
+                body = _image_metadata.format(timeStamp=embedded, gain=rng.randrange(32), shutter=rng.randrange(1000),
+                                              exposure=rng.randrange(1000), frameCounter=frameNumber)
+                _write(os.path.join(directory, prefix + seperator + 'ImageMetadata.xml'), 'ImageMetadata', body)
+                metadata_files += 1
+                images += 1
+    return serials, metadata_files, images
+
+
+@click.command()
+@click.option('--data_dir', help='directory to create the capture tree in, must not exist', required=True)
+@click.option('--cameras', help='number of cameras', default=2)
+@click.option('--fps', help='frames per second of each camera', default=15)
+@click.option('--hours', help='number of hour directories', default=1)
+@click.option('--seconds', help='seconds recorded at the start of each hour', default=60)
+@click.option('--seperator', help='seperator used in file names', type=click.Choice(['.', '_']), default='_')
+@click.option('--jitter', help='maximum delay of creationTimeStamps in microseconds', default=3000)
+@click.option('--drift', help='drift of the embedded clock of each camera relative to the previous one in parts per million', default=0)
+@click.option('--seed', help='random seed', default=0)
+def main(data_dir, cameras, fps, hours, seconds, seperator, jitter, drift, seed):
+    serials, metadata_files, images = generate(data_dir, cameras, fps, hours, seconds, seperator, 
+                                               jitter=jitter, drift=drift, seed=seed)
+    print('{} metadata files and {} images of cameras {} written'.format(metadata_files, images, serials))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Generates a synthetic capture tree for each seperator, loads it with
+populate_db into a fresh local SQLite database and times find_pairs over
+the whole capture. Each command runs in its own process with a config.py
+pointing at that database, and the results are printed as JSON so that
+runs can be compared.
+
+    python -m benchmarks.end_to_end --cameras 2 --fps 15 --hours 2 --json_file results.json
+"""
+from __future__ import print_function
+from benchmarks import capture_tree
+from datetime import timedelta
+import subprocess
+import tempfile
+import shutil
+import click
+import json
+import time
+import sys
+import os
+
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(work_dir, args, input=''):
+    """
+    Runs psitres.py with args in work_dir and returns its output, wall clock
+    seconds and peak resident set size in kilobytes, which includes the
+    ingest processes it waited for.
+    """
+    env = dict(os.environ, PYTHONPATH=_root, PYTHONWARNINGS='ignore')
+    with tempfile.TemporaryFile() as out:
+        t = time.time()
+        process = subprocess.Popen([sys.executable, os.path.join(_root, 'psitres.py')] + args, cwd=work_dir, env=env,
+                                   stdin=subprocess.PIPE, stdout=out, stderr=subprocess.STDOUT)
+        process.stdin.write(input)
+        process.stdin.close()
+        _, status, rusage = os.wait4(process.pid, 0)
+        t = time.time() - t
+        # already reaped by wait4
+        process.returncode = status
+        out.seek(0)
+        output = out.read()
+    if status != 0:
+        raise RuntimeError('psitres.py {} failed:\n{}'.format(' '.join(args), output))
+    return output, t, rusage.ru_maxrss
+
+
+def _case(work_dir, seperator, cameras, fps, hours, seconds, populate_options, repeat):
+    data_dir = os.path.join(work_dir, 'data')
+    t = time.time()
+    serials, metadata_files, images = capture_tree.generate(data_dir, cameras, fps, hours, seconds, seperator)
+    generate_seconds = time.time() - t
+    with open(os.path.join(work_dir, 'config.py'), 'w') as fp:
+        fp.write(repr({'sqlalchemy.url':'sqlite:///' + os.path.join(work_dir, 'benchmark.db')}))
+
+    output, t, rss = _run(work_dir, ['populate_db', '--data_dir', data_dir, '--recreate'] + list(populate_options), 'y\n')
+    summary = json.loads([line for line in output.splitlines() if line.startswith('{')][-1])
+    populate_db = {'seconds':t, 'files_per_second':metadata_files / t, 'peak_rss_kb':rss,
+                   'rows':summary['rows'], 'stages':summary['stages']}
+
+    start = capture_tree.default_start
+    stop = start + timedelta(hours=hours)
+    args = ['find_pairs', '--start', start.strftime('%Y-%m-%d %H:%M:%S.%f'), '--stop', stop.strftime('%Y-%m-%d %H:%M:%S.%f'),
+            '--seperator', seperator, '--serial_numbers', str(serials[0]), str(serials[1]),
+            '--data_dir', data_dir, '--out_file', os.path.join(work_dir, 'pairs.csv')]
+    find_pairs = {'seconds':[], 'latency_seconds':[], 'peak_rss_kb':0}
+    for _ in xrange(repeat):
+        output, t, rss = _run(work_dir, args)
+        written = [line for line in output.splitlines() if ' pairs written to disk in ' in line][-1].split()
+        find_pairs['pairs'] = int(written[0])
+        find_pairs['seconds'].append(t)
+        find_pairs['latency_seconds'].append(float(written[-2]))
+        find_pairs['peak_rss_kb'] = max(find_pairs['peak_rss_kb'], rss)
+    return {'seperator':seperator, 'cameras':cameras, 'fps':fps, 'hours':hours, 'seconds':seconds,
+            'metadata_files':metadata_files, 'images':images, 'generate_seconds':generate_seconds,
+            'populate_db':populate_db, 'find_pairs':find_pairs}
+
+
+@click.command()
+@click.option('--cameras', help='number of cameras', default=2)
+@click.option('--fps', help='frames per second of each camera', default=15)
+@click.option('--hours', help='number of hour directories', default=2)
+@click.option('--seconds', help='seconds recorded at the start of each hour', default=60)
+@click.option('--seperator', help='seperator used in file names, repeated for each capture tree',
+              type=click.Choice(['.', '_']), multiple=True, default=['_', '.'])
+@click.option('--populate_option', help='option passed on to populate_db, repeated for each option, e.g. --populate_option=--stream',
+              multiple=True)
+@click.option('--repeat', help='number of timed find_pairs runs', default=3)
+@click.option('--work_dir', help='directory for the capture trees and databases, a temporary one is removed afterwards')
+@click.option('--json_file', help='file the results are written to in addition to standard output')
+def main(cameras, fps, hours, seconds, seperator, populate_option, repeat, work_dir, json_file):
+    if cameras < 2:
+        raise click.BadParameter('find_pairs needs at least two cameras', param_hint='--cameras')
+    temporary = work_dir is None
+    work_dir = tempfile.mkdtemp() if temporary else os.path.abspath(work_dir)
+    try:
+        results = []
+        for s in seperator:
+            case_dir = os.path.join(work_dir, 'seperator' + {'.':'dot', '_':'underscore'}[s])
+            os.makedirs(case_dir)
+            results.append(_case(case_dir, s, cameras, fps, hours, seconds, populate_option, repeat))
+    finally:
+        if temporary:
+            shutil.rmtree(work_dir)
+    results = json.dumps(results, indent=2, sort_keys=True)
+    print(results)
+    if json_file:
+        with open(json_file, 'w') as fp:
+            fp.write(results + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Loads synthetic ImageMetadata rows into the database configured in 
+config.py and reports the find_pairs query time as the table grows. 
+All data in the database is deleted first.
+
+    python -m benchmarks.find_pairs_query --rows 1000000 --rows 10000000 --rows 100000000
+"""
+from __future__ import print_function
+from psitres import interface
+from psitres import models
+from psitres import utils
+from datetime import datetime, timedelta
+from sqlalchemy import table, column
+import click
+import time
+
+
+def _load(session, serial_numbers, fps, begin, end):
+    """
+    Inserts frames begin to end (exclusive) of every camera, binding raw 
+    integer timestamps to skip the MicrosecondTimestamp conversion.
+    """
+    frames = table(models.ImageMetadata.__tablename__, 
+                   column('creationTimeStamp'), column('serialNumber'), column('frameNumber'))
+    start = utils.microseconds(datetime(2017, 1, 1))
+    step = 10 ** 6 / fps
+    rows = [{'creationTimeStamp':start + i * step + j * 97, 'serialNumber':serialNumber, 'frameNumber':i}
+            for i in xrange(begin, end) for j, serialNumber in enumerate(serial_numbers)]
+    session.execute(frames.insert(), rows)
+    session.commit()
+    
+    
+@click.command()
+@click.option('--rows', help='table size at which the query is timed, repeated for each size', 
+              type=int, multiple=True, default=[10 ** 6, 10 ** 7, 10 ** 8])
+@click.option('--cameras', help='number of cameras', default=2)
+@click.option('--fps', help='frames per second of each camera', default=15)
+@click.option('--window', help='length of the queried time range in seconds', default=3600)
+@click.option('--repeat', help='number of timed queries per size', default=3)
+@click.option('--chunk_size', help='number of frames inserted per statement', default=100000)
+def main(rows, cameras, fps, window, repeat, chunk_size):
+    click.confirm('Are you sure you want to delete all data in the database?', abort=True)
+    models.recreate()
+    session = models.Session()
+    serial_numbers = range(10000000, 10000000 + cameras)
+    loaded = 0
+    for size in sorted(rows):
+        frames = size / cameras
+        for begin in xrange(loaded, frames, chunk_size):
+            _load(session, serial_numbers, fps, begin, min(begin + chunk_size, frames))
+        loaded = frames
+        
+        # a window in the middle of the loaded range
+        middle = datetime(2017, 1, 1) + timedelta(seconds=frames / 2.0 / fps)
+        start, stop = middle - timedelta(seconds=window / 2.0), middle + timedelta(seconds=window / 2.0)
+        times = []
+        for _ in xrange(repeat):
+            t = time.time()
+            fetched = sum(len(timestamps) for timestamps, _, _ in 
+                          interface._fetch_frames(session, start, stop, serial_numbers[:2], 100000))
+            times.append(time.time() - t)
+            session.commit()
+        print('{} rows: {} frames fetched in {} seconds (best of {})'.format(frames * cameras, fetched, min(times), repeat))
+        
+        
+if __name__ == '__main__':
+    main()
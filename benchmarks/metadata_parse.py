@@ -0,0 +1,73 @@
+"""
+Files per second of the original _xml2model metadata parsing against 
+psitres.metadata.parse over a synthetic directory of CameraInfo and 
+ImageMetadata files.
+
+    python -m benchmarks.metadata_parse --n 20000
+"""
+from __future__ import print_function
+from psitres import metadata
+from psitres import models
+from lxml import etree
+import tempfile
+import shutil
+import click
+import time
+import os
+
+
+_CameraInfo = ('<PSITRES><CameraInfo><serialNumber>{serialNumber}</serialNumber><isColorCamera>false</isColorCamera>'
+               '<modelName>Flea3 FL3-U3-13E4C</modelName><vendorName>Point Grey Research</vendorName>'
+               '<sensorResolution>1280x1024</sensorResolution><firmwareVersion>1.8.3.0</firmwareVersion>'
+               '<busNumber>1</busNumber><nodeNumber>0</nodeNumber><interfaceType>4</interfaceType>'
+               '<maximumBusSpeed>5</maximumBusSpeed></CameraInfo></PSITRES>')
+_ImageMetadata = ('<PSITRES><ImageMetadata><embeddedTimeStamp>{i}</embeddedTimeStamp><embeddedGain>23</embeddedGain>'
+                  '<embeddedShutter>512</embeddedShutter><embeddedBrightness>0</embeddedBrightness>'
+                  '<embeddedExposure>318</embeddedExposure><embeddedWhiteBalance>0</embeddedWhiteBalance>'
+                  '<embeddedFrameCounter>{i}</embeddedFrameCounter><embeddedStrobePattern>0</embeddedStrobePattern>'
+                  '<embeddedGPIOPinState>0</embeddedGPIOPinState><embeddedROIPosition>0</embeddedROIPosition>'
+                  '</ImageMetadata></PSITRES>')
+
+
+def _legacy_parse(path, modelName):
+    table = getattr(models, modelName).__table__
+    instance = {}
+    with open(path, 'r') as fp:
+        root_node = etree.fromstring(fp.read())
+    root_node = root_node.find(modelName)
+    for attribute in root_node:
+        column = getattr(table.columns, attribute.tag)
+        instance[attribute.tag] = column.type.python_type(attribute.text)
+    return instance
+
+
+def _write_files(path, n):
+    files = []
+    for i in xrange(n):
+        modelName = 'CameraInfo' if i % 10 == 0 else 'ImageMetadata'
+        template = _CameraInfo if modelName == 'CameraInfo' else _ImageMetadata
+        fname = os.path.join(path, '{}.{}.xml'.format(i, modelName))
+        with open(fname, 'w') as fp:
+            fp.write(template.format(i=i, serialNumber=10000000 + i % 4))
+        files.append((fname, modelName))
+    return files
+
+
+@click.command()
+@click.option('--n', help='number of synthetic metadata files', default=10000)
+def main(n):
+    path = tempfile.mkdtemp()
+    try:
+        files = _write_files(path, n)
+        for name, parse in (('before', _legacy_parse), ('after', metadata.parse)):
+            t = time.time()
+            for fname, modelName in files:
+                parse(fname, modelName)
+            t = time.time() - t
+            print('{}: {} files / {} seconds = {} files per second'.format(name, n, t, n / t))
+    finally:
+        shutil.rmtree(path)
+        
+        
+if __name__ == '__main__':
+    main()
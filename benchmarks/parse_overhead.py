@@ -0,0 +1,71 @@
+"""
+Per-file overhead of resolving a capture file name and its model schema, 
+comparing the original per-call regex compilation and live index reflection 
+against the precompiled pattern and psitres.models.schemas.
+
+    python -m benchmarks.parse_overhead --n 100000
+"""
+from __future__ import print_function
+from psitres import interface
+from psitres import models
+from datetime import datetime, timedelta
+import click
+import time
+import re
+
+
+def _legacy_parse_fname(fname):
+    re_creationTimeStamp = r'(?P<creationTimeStamp>\d{8}T\d{6}(\.\d{6})?)'
+    re_serialNumber = r'(?P<serialNumber>\d+)'
+    re_modelName = r'(?P<modelName>[a-zA-Z]\w*)'
+    re_frameNumber = r'(?P<frameNumber>\d+)'
+    re_ext = r'\w{3}'
+    pattern = r'^{creationTimeStamp}(\.|_){serialNumber}((\.|_){frameNumber}\.{ext})?((\.|_){modelName}\.{ext})?$'.format(
+                                                                  creationTimeStamp=re_creationTimeStamp,
+                                                                  serialNumber=re_serialNumber,
+                                                                  modelName=re_modelName,
+                                                                  frameNumber=re_frameNumber,
+                                                                  ext=re_ext)
+    return re.match(pattern, fname).groupdict()
+
+
+def _legacy(fnames):
+    for fname in fnames:
+        attributes = _legacy_parse_fname(fname)
+        model = getattr(models, attributes['modelName'])
+        [index for index in models.inspector.get_indexes(model.__tablename__)
+         if index['name'] == 'creationTimeStamp_serialNumber']
+        
+        
+def _current(fnames):
+    for fname in fnames:
+        attributes = interface._parse_fname(fname)
+        models.schemas[attributes['modelName']].unique_index
+    
+    
+def _fnames(n):
+    timestamp = datetime(2017, 1, 1)
+    fnames = []
+    for i in xrange(n):
+        timestamp += timedelta(microseconds=66667)
+        seperator = '._'[i % 2]
+        fnames.append(seperator.join((timestamp.strftime('%Y%m%dT%H%M%S.%f'), str(10000000 + i % 4), 'ImageMetadata.xml')))
+    return fnames
+
+
+def _report(name, fnames, t):
+    print('{}: {} files / {} seconds = {} microseconds per file'.format(name, len(fnames), t, t / len(fnames) * 10 ** 6))
+    
+    
+@click.command()
+@click.option('--n', help='number of synthetic file names', default=10000)
+def main(n):
+    fnames = _fnames(n)
+    for name, f in (('before', _legacy), ('after', _current)):
+        t = time.time()
+        f(fnames)
+        _report(name, fnames, time.time() - t)
+        
+        
+if __name__ == '__main__':
+    main()
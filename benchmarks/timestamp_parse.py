@@ -0,0 +1,66 @@
+"""
+Per-stamp cost of converting capture file name creationTimeStamps to
+microseconds since the epoch, comparing the original strptime with its
+fallback format against the fixed layout parsers in psitres.frames.
+
+    python -m benchmarks.timestamp_parse --n 100000
+"""
+from __future__ import print_function
+from psitres import frames
+from psitres import utils
+from datetime import datetime, timedelta
+import click
+import time
+
+
+def _legacy(stamps):
+    timestamps = []
+    for stamp in stamps:
+        try:
+            timestamp = datetime.strptime(stamp, '%Y%m%dT%H%M%S.%f')
+        except ValueError:
+            timestamp = datetime.strptime(stamp, '%Y%m%dT%H%M%S')
+        timestamps.append(utils.microseconds(timestamp))
+    return timestamps
+
+
+def _datetime(stamps):
+    return [utils.microseconds(frames.parse_creationTimeStamp(stamp)) for stamp in stamps]
+
+
+def _scalar(stamps):
+    return [frames.stamp_microseconds(stamp) for stamp in stamps]
+
+
+def _batch(stamps):
+    return frames.stamps_microseconds(stamps).tolist()
+
+
+def _stamps(n):
+    timestamp = datetime(2017, 1, 1)
+    stamps = []
+    for i in xrange(n):
+        timestamp += timedelta(microseconds=66667)
+        # a few stamps without the fraction take the strptime fallback
+        stamps.append(timestamp.strftime('%Y%m%dT%H%M%S' if i % 100 == 0 else '%Y%m%dT%H%M%S.%f'))
+    return stamps
+
+
+@click.command()
+@click.option('--n', help='number of synthetic creationTimeStamps', default=100000)
+def main(n):
+    stamps = _stamps(n)
+    expected = None
+    for name, f in (('strptime', _legacy), ('parse_creationTimeStamp', _datetime),
+                    ('stamp_microseconds', _scalar), ('stamps_microseconds', _batch)):
+        t = time.time()
+        timestamps = f(stamps)
+        t = time.time() - t
+        expected = expected or timestamps
+        if timestamps != expected:
+            raise AssertionError('{} disagrees with strptime'.format(name))
+        print('{}: {} stamps / {} seconds = {} microseconds per stamp'.format(name, n, t, t / n * 10 ** 6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Round trip exactness and per-row cost of MicrosecondTimestamp, comparing
+the original float conversion against the integer conversion and the raw
+mode used by bulk readers. Fails if any value does not round trip exactly.
+
+    python -m benchmarks.timestamp_type --n 1000000
+"""
+from __future__ import print_function
+from psitres import models
+from psitres import utils
+from datetime import datetime, timedelta
+import click
+import random
+import time
+
+
+def _legacy_bind(value):
+    return long((value - utils.epoch).total_seconds() * 10 ** 6)
+
+
+def _legacy_result(value):
+    return utils.epoch + timedelta(microseconds=value)
+
+
+def _timestamps(n, seed):
+    'Random datetimes with microseconds between 1970 and 2100'
+    rng = random.Random(seed)
+    span = utils.microseconds(datetime(2100, 1, 1))
+    return [utils.from_microseconds(rng.randrange(span)) for _ in xrange(n)]
+
+
+def _time(f, values):
+    t = time.time()
+    results = map(f, values)
+    return results, time.time() - t
+
+
+def _report(name, n, t):
+    print('{}: {} rows / {} seconds = {} microseconds per row'.format(name, n, t, t / n * 10 ** 6))
+
+
+@click.command()
+@click.option('--n', help='number of random timestamps', default=1000000)
+@click.option('--seed', help='random seed', default=0)
+def main(n, seed):
+    timestamps = _timestamps(n, seed)
+    type_, raw = models.MicrosecondTimestamp(), models.MicrosecondTimestamp(raw=True)
+    bind = lambda value: type_.process_bind_param(value, None)
+    result = lambda value: type_.process_result_value(value, None)
+    raw_result = raw.result_processor(None, None) or (lambda value: value)
+
+    legacy_values, t = _time(_legacy_bind, timestamps)
+    _report('original bind', n, t)
+    values, t = _time(bind, timestamps)
+    _report('integer bind', n, t)
+    legacy_roundtrip, t = _time(_legacy_result, legacy_values)
+    _report('original result', n, t)
+    roundtrip, t = _time(result, values)
+    _report('datetime result', n, t)
+    raw_values, t = _time(raw_result, values)
+    _report('raw result', n, t)
+
+    print('float bind: {} of {} values off by a microsecond or more'.format(
+          sum(a != b for a, b in zip(legacy_values, values)), n))
+    print('float round trip: {} of {} timestamps changed'.format(
+          sum(a != b for a, b in zip(legacy_roundtrip, timestamps)), n))
+    if roundtrip != timestamps or raw_values != values:
+        raise AssertionError('integer round trip changed some timestamps')
+    print('integer round trip: exact for all {} timestamps'.format(n))
+
+
+if __name__ == '__main__':
+    main()
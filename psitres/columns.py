@@ -0,0 +1,108 @@
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+import numpy as np
+import numpy.lib.format
+import zipfile
+import tempfile
+import shutil
+import os
+
+
+# stands in for NULL in int64 columns of npy and npz files, parquet keeps NULLs
+null = np.iinfo(np.int64).min
+
+
+class NpyWriter(object):
+    """
+    Streams chunks of int64 columns into a directory with one .npy file per
+    column, which np.load can memory map. Each column is appended to a raw
+    part file and gets its .npy header once the number of rows is known.
+    """
+    def __init__(self, path, columns):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.columns = columns
+        self.rows = 0
+        self._parts = [open(self._column_path(column) + '.part', 'wb') for column in columns]
+
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+    def _column_path(self, column):
+        return os.path.join(self.path, column + '.npy')
+    def write(self, chunk):
+        'Appends a chunk given as an int64 array per column'
+        for part, array in zip(self._parts, chunk):
+            part.write(np.asarray(array, '<i8').tostring())
+        self.rows += len(chunk[0])
+    def close(self):
+        for column, part in zip(self.columns, self._parts):
+            part.close()
+            with open(self._column_path(column), 'wb') as fp:
+                numpy.lib.format.write_array_header_1_0(fp, {'descr':'<i8', 'fortran_order':False, 'shape':(self.rows,)})
+                with open(part.name, 'rb') as raw:
+                    shutil.copyfileobj(raw, fp)
+            os.remove(part.name)
+    def _discard(self):
+        for part in self._parts:
+            part.close()
+            os.remove(part.name)
+
+
+class NpzWriter(NpyWriter):
+    """
+    Same as NpyWriter but stores the .npy files uncompressed in a single
+    .npz file, so their data can still be memory mapped at their offsets.
+    """
+    def __init__(self, path, columns):
+        self.npz_path = path
+        super(NpzWriter, self).__init__(tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path))), columns)
+    def close(self):
+        try:
+            super(NpzWriter, self).close()
+            with zipfile.ZipFile(self.npz_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as npz:
+                for column in self.columns:
+                    npz.write(self._column_path(column), column + '.npy')
+        finally:
+            shutil.rmtree(self.path)
+    def _discard(self):
+        super(NpzWriter, self)._discard()
+        shutil.rmtree(self.path)
+
+
+class ParquetWriter(object):
+    'Streams chunks of int64 columns into a Parquet file, one row group per chunk'
+    def __init__(self, path, columns):
+        if pyarrow is None:
+            raise ImportError('writing Parquet files requires pyarrow')
+        self.path = path
+        self.columns = columns
+        self.rows = 0
+        schema = pyarrow.schema([pyarrow.field(column, pyarrow.int64()) for column in columns])
+        self._writer = pyarrow.parquet.ParquetWriter(path, schema)
+
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        if exc_type is not None:
+            os.remove(self.path)
+
+    def write(self, chunk):
+        arrays = [pyarrow.array(array, pyarrow.int64(), mask=array == null) for array in chunk]
+        self._writer.write_table(pyarrow.Table.from_arrays(arrays, self.columns))
+        self.rows += len(chunk[0])
+    def close(self):
+        self._writer.close()
+
+
+writers = {'npy':NpyWriter, 'npz':NpzWriter, 'parquet':ParquetWriter}
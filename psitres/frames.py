@@ -0,0 +1,291 @@
+from psitres import utils
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+import numpy as np
+import threading
+import json
+import re
+import os
+
+
+_re_fname = re.compile(r'^{creationTimeStamp}(\.|_){serialNumber}((\.|_){frameNumber}\.{ext})?((\.|_){modelName}\.{ext})?$'.format(
+                           creationTimeStamp=r'(?P<creationTimeStamp>\d{8}T\d{6}(\.\d{6})?)',
+                           serialNumber=r'(?P<serialNumber>\d+)',
+                           modelName=r'(?P<modelName>[a-zA-Z]\w*)',
+                           frameNumber=r'(?P<frameNumber>\d+)',
+                           ext=r'\w{3}'))
+
+
+def parse_fname(fname):
+    return _re_fname.match(fname).groupdict()
+
+
+def hour_directories(root_path):
+    'Sorted YYYYMMDD/HH directories of a capture tree, relative to root_path'
+    return [os.path.join(d1, d2) 
+            for d1 in sorted(os.listdir(root_path)) 
+            if os.path.isdir(os.path.join(root_path, d1))
+            for d2 in sorted(os.listdir(os.path.join(root_path, d1))) 
+            if os.path.isdir(os.path.join(root_path, d1, d2))]
+
+
+def parse_hour_directory(rel_dir):
+    'datetime at which the YYYYMMDD/HH directory rel_dir starts'
+    return datetime.strptime(rel_dir, os.path.join('%Y%m%d', '%H'))
+
+
+_epoch_ordinal = utils.epoch.toordinal()
+# positions of the digits of year, month, day, hour, minute, second and microsecond in %Y%m%dT%H%M%S.%f
+_fields = ((0, 4), (4, 6), (6, 8), (9, 11), (11, 13), (13, 15), (16, 22))
+_digits = [i for start, stop in _fields for i in xrange(start, stop)]
+# days per month of a common year, indexed by month
+_month_days = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def _stamp_fields(creationTimeStamp):
+    """
+    Splits a creationTimeStamp formatted as %Y%m%dT%H%M%S.%f, or without 
+    the fraction, into its integer fields.
+    """
+    n = len(creationTimeStamp)
+    if not ((n == 22 and creationTimeStamp[15] == '.') or n == 15) or creationTimeStamp[8] != 'T':
+        raise ValueError('creationTimeStamp does not match %Y%m%dT%H%M%S.%f: {!r}'.format(creationTimeStamp))
+    fields = (int(creationTimeStamp[0:4]), int(creationTimeStamp[4:6]), int(creationTimeStamp[6:8]), 
+              int(creationTimeStamp[9:11]), int(creationTimeStamp[11:13]), int(creationTimeStamp[13:15]), 
+              int(creationTimeStamp[16:22]) if n == 22 else 0)
+    # dates are checked by date or datetime
+    if fields[3] > 23 or fields[4] > 59 or fields[5] > 59:
+        raise ValueError('creationTimeStamp is not a valid time: {!r}'.format(creationTimeStamp))
+    return fields
+
+
+def parse_creationTimeStamp(creationTimeStamp):
+    'datetime of a creationTimeStamp formatted as %Y%m%dT%H%M%S.%f, or without the fraction'
+    return datetime(*_stamp_fields(creationTimeStamp))
+
+
+def stamp_microseconds(creationTimeStamp):
+    'Same as utils.microseconds(parse_creationTimeStamp(creationTimeStamp)) without the datetime'
+    year, month, day, hour, minute, second, microsecond = _stamp_fields(creationTimeStamp)
+    days = date(year, month, day).toordinal() - _epoch_ordinal
+    return (((days * 24 + hour) * 60 + minute) * 60 + second) * 10 ** 6 + microsecond
+
+
+def stamps_microseconds(creationTimeStamps):
+    """
+    Vectorized stamp_microseconds over a sequence of creationTimeStamps, 
+    such as those of a whole directory listing. Returns an int64 array.
+    """
+    stamps = np.array([stamp if len(stamp) != 15 else stamp + '.000000' for stamp in creationTimeStamps], 'S22')
+    chars = stamps.view(np.uint8).reshape(len(stamps), 22).astype(np.int64)
+    digits = chars[:, _digits] - ord('0')
+    if (digits < 0).any() or (digits > 9).any() or (chars[:, 8] != ord('T')).any() or (chars[:, 15] != ord('.')).any():
+        raise ValueError('some creationTimeStamps do not match %Y%m%dT%H%M%S.%f')
+    fields, i = [], 0
+    for start, stop in _fields:
+        value = 0
+        for j in xrange(i, i + stop - start):
+            value = value * 10 + digits[:, j]
+        fields.append(value)
+        i += stop - start
+    year, month, day, hour, minute, second, microsecond = fields
+    # the same dates and times that datetime, and so stamp_microseconds, accepts
+    if (year < 1).any() or (month < 1).any() or (month > 12).any():
+        raise ValueError('some creationTimeStamps are not valid dates')
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    if (day < 1).any() or (day > _month_days[month] + (leap & (month == 2))).any():
+        raise ValueError('some creationTimeStamps are not valid dates')
+    if (hour > 23).any() or (minute > 59).any() or (second > 59).any():
+        raise ValueError('some creationTimeStamps are not valid times')
+    # days from the civil date, counting years from March so that leap days come last
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    days = era * 146097 + doe - 719468
+    return (((days * 24 + hour) * 60 + minute) * 60 + second) * 10 ** 6 + microsecond
+    
+    
+class FrameNumbers(object):
+    """
+    Frame numbers of the images in one capture directory, keyed by 
+    serialNumber and creationTimeStamp in microseconds since the epoch 
+    and stored as sorted int64 arrays, so that they pickle compactly.
+    """
+    def __init__(self, serialNumbers, timestamps, frameNumbers):
+        serialNumbers = np.asarray(serialNumbers, np.int64)
+        timestamps = np.asarray(timestamps, np.int64)
+        order = np.lexsort((timestamps, serialNumbers))
+        self.serialNumbers = serialNumbers[order]
+        self.timestamps = timestamps[order]
+        self.frameNumbers = np.asarray(frameNumbers, np.int64)[order]
+        
+    def save(self, path):
+        """
+        Writes the arrays to the .npy file at path and returns a 
+        SavedFrameNumbers handle that can be pickled cheaply.
+        """
+        np.save(path, np.vstack((self.serialNumbers, self.timestamps, self.frameNumbers)))
+        return SavedFrameNumbers(path)
+    @classmethod
+    def load(cls, path):
+        'Memory maps FrameNumbers written by save'
+        self = cls.__new__(cls)
+        self.serialNumbers, self.timestamps, self.frameNumbers = np.load(path, mmap_mode='r')
+        return self
+        
+    @classmethod
+    def from_directory(cls, path):
+        return cls.from_names(entry.name for entry in utils.scandir(path))
+    @classmethod
+    def from_names(cls, fnames):
+        'FrameNumbers of the image file names among fnames, other files are skipped'
+        serialNumbers, timestamps, frameNumbers = [], [], []
+        for fname in fnames:
+            match = _re_fname.match(fname)
+            if match is None:
+                continue
+            attributes = match.groupdict()
+            if attributes['frameNumber'] is not None:
+                serialNumbers.append(int(attributes['serialNumber']))
+                timestamps.append(attributes['creationTimeStamp'])
+                frameNumbers.append(int(attributes['frameNumber']))
+        return cls(serialNumbers, stamps_microseconds(timestamps), frameNumbers)
+    
+    def __len__(self):
+        return len(self.frameNumbers)
+    def __getitem__(self, key):
+        serialNumber, timestamp = key
+        lo = np.searchsorted(self.serialNumbers, serialNumber, 'left')
+        hi = np.searchsorted(self.serialNumbers, serialNumber, 'right')
+        i = lo + np.searchsorted(self.timestamps[lo:hi], timestamp)
+        if i < hi and self.timestamps[i] == timestamp:
+            return int(self.frameNumbers[i])
+        raise KeyError(key)
+    
+    
+class FrameIndex(object):
+    """
+    Least recently used cache of FrameNumbers by path, 
+    loaded by FrameNumbers.from_directory by default.
+    """
+    def __init__(self, maxsize=16, load=FrameNumbers.from_directory):
+        self.maxsize = maxsize
+        self.load = load
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lck = threading.Lock()
+        
+    def __getitem__(self, path):
+        with self._lck:
+            try:
+                frameNumbers = self._cache.pop(path)
+                self.hits += 1
+            except KeyError:
+                frameNumbers = self.load(path)
+                self.misses += 1
+                while len(self._cache) >= self.maxsize:
+                    self._cache.popitem(last=False)
+            self._cache[path] = frameNumbers
+            return frameNumbers
+            
+    def drain(self):
+        'Returns (hits, misses) counted so far and resets them'
+        with self._lck:
+            drained = self.hits, self.misses
+            self.hits = self.misses = 0
+        return drained
+    def merge(self, drained):
+        hits, misses = drained
+        with self._lck:
+            self.hits += hits
+            self.misses += misses
+            
+            
+class SavedFrameNumbers(object):
+    """
+    Picklable handle to FrameNumbers written by FrameNumbers.save. Each 
+    process memory maps the file once on first use.
+    """
+    _loaded = FrameIndex(load=FrameNumbers.load)
+    
+    def __init__(self, path):
+        self.path = path
+    def __len__(self):
+        return len(self._loaded[self.path])
+    def __getitem__(self, key):
+        return self._loaded[self.path][key]
+
+    
+class CaptureIndex(object):
+    """
+    Database free index of the frames of a capture tree: the FrameNumbers 
+    of each YYYYMMDD/HH directory in a memory mappable .npy file, plus a 
+    manifest of the state of the directories they were built from, so 
+    that update only rebuilds new or changed directories.
+    """
+    manifest_name = 'manifest.json'
+    
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(os.path.join(path, self.manifest_name)) as fp:
+                self.manifest = json.load(fp)
+        except IOError:
+            self.manifest = {}
+            
+    def _frames_path(self, directory):
+        return os.path.join(self.path, directory.replace('/', '_') + '.npy')
+    def update(self, root_path):
+        """
+        Indexes the hour directories of root_path that are new or whose 
+        file count or latest modification time changed since the last 
+        update. Returns the number of directories indexed and skipped.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        indexed, skipped = 0, 0
+        for rel_dir in hour_directories(root_path):
+            directory = rel_dir.replace(os.sep, '/')
+            entries = list(utils.scandir(os.path.join(root_path, rel_dir)))
+            state = [len(entries), max([long(round(entry.stat().st_mtime * 10 ** 6)) for entry in entries] or [0])]
+            if self.manifest.get(directory) == state:
+                skipped += 1
+                continue
+            FrameNumbers.from_names(entry.name for entry in entries).save(self._frames_path(directory))
+            self.manifest[directory] = state
+            indexed += 1
+        # replaced atomically so that an interrupted update leaves a consistent manifest
+        manifest_path = os.path.join(self.path, self.manifest_name)
+        with open(manifest_path + '.tmp', 'w') as fp:
+            json.dump(self.manifest, fp, sort_keys=True)
+        os.rename(manifest_path + '.tmp', manifest_path)
+        return indexed, skipped
+    
+    def frames(self, start, stop, serial_numbers):
+        """
+        Yields (creationTimeStamp, serialNumber, frameNumber) int64 arrays of 
+        the frames of serial_numbers in [start, stop), one chunk per hour 
+        directory ordered by creationTimeStamp, like a database query would.
+        """
+        begin, end = utils.microseconds(start), utils.microseconds(stop)
+        for directory in sorted(self.manifest):
+            hour = parse_hour_directory(directory.replace('/', os.sep))
+            if not (hour < stop and start < hour + timedelta(hours=1)):
+                continue
+            frameNumbers = FrameNumbers.load(self._frames_path(directory))
+            chunk = [], [], []
+            for serialNumber in serial_numbers:
+                lo = np.searchsorted(frameNumbers.serialNumbers, serialNumber, 'left')
+                hi = np.searchsorted(frameNumbers.serialNumbers, serialNumber, 'right')
+                timestamps = frameNumbers.timestamps[lo:hi]
+                lo, hi = lo + np.searchsorted(timestamps, begin, 'left'), lo + np.searchsorted(timestamps, end, 'left')
+                chunk[0].append(frameNumbers.timestamps[lo:hi])
+                chunk[1].append(frameNumbers.serialNumbers[lo:hi])
+                chunk[2].append(frameNumbers.frameNumbers[lo:hi])
+            timestamps, serialNumbers, frameNumbers = [np.concatenate(arrays) for arrays in chunk]
+            if len(timestamps):
+                order = np.argsort(timestamps, kind='mergesort')
+                yield timestamps[order], serialNumbers[order], frameNumbers[order]
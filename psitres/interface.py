@@ -1,77 +1,50 @@
 from psitres import utils
 from psitres import models
 from psitres import pe
-from lxml import etree
-from datetime import datetime
+from psitres import frames
+from psitres import matching
+from psitres import metadata
+from psitres import profiling
+from psitres import columns
+from datetime import datetime, timedelta
 import multiprocessing as mp
 import click
 import bisect
 import os
 import time
-import re
 import warnings
 import csv
+import itertools
+import json
+import tempfile
+import shutil
+import cPickle
 from sqlalchemy.inspection import inspect
-import joblib
-
-
-def _parse_fname(fname):
-    re_creationTimeStamp = r'(?P<creationTimeStamp>\d{8}T\d{6}(\.\d{6})?)'
-    re_serialNumber = r'(?P<serialNumber>\d+)'
-    re_modelName = r'(?P<modelName>[a-zA-Z]\w*)'
-    re_frameNumber = r'(?P<frameNumber>\d+)'
-    re_ext = r'\w{3}'
-    pattern = r'^{creationTimeStamp}(\.|_){serialNumber}((\.|_){frameNumber}\.{ext})?((\.|_){modelName}\.{ext})?$'.format(
-                                                                  creationTimeStamp=re_creationTimeStamp,
-                                                                  serialNumber=re_serialNumber,
-                                                                  modelName=re_modelName,
-                                                                  frameNumber=re_frameNumber,
-                                                                  ext=re_ext)
-    return re.match(pattern, fname).groupdict()
-        
-        
-def _cached_frameNumbers(root_path, rel_dir):
-    cache_key = _cached_frameNumbers, root_path, rel_dir
-    try:
-        return globals()[cache_key]
-    except KeyError:
-        frameNumber_index = {}
-        for f in os.listdir(os.path.join(root_path, rel_dir)):
-            attributes = _parse_fname(f)
-                
-            if attributes['frameNumber'] is not None:
-                frameNumber = int(attributes['frameNumber'])
-                key = (int(attributes['serialNumber']),)
-                try:
-                    key = key + (datetime.strptime(attributes['creationTimeStamp'], '%Y%m%dT%H%M%S.%f'),)
-                except ValueError:
-                    key = key + (datetime.strptime(attributes['creationTimeStamp'], '%Y%m%dT%H%M%S'),)                    
-                frameNumber_index[key] = frameNumber
-            else:
-                continue
-        index = sorted(frameNumber_index)
-        frameNumbers = [frameNumber_index[k] for k in index]
-        
-        globals()[cache_key] = (index, frameNumbers)
-        return globals()[cache_key]
-            
-    
-def _xml2model(root_path, rel_path, session):
+from sqlalchemy import select, and_, or_, func
+import numpy as np
+
+
+_parse_fname = frames.parse_fname
+_frame_index = frames.FrameIndex()
+# hits and misses of the ingest processes are merged into those of this process, like the stages
+_caches = {'frame index':_frame_index, 'saved frame numbers':frames.SavedFrameNumbers._loaded}
+
+
+@profiling.stages.timed('filename parse')
+def _parse_attributes(root_path, rel_path, frameNumbers=None):
     rel_dir, fname = os.path.split(rel_path)
     attributes = _parse_fname(fname)    
     modelName = attributes.pop('modelName')
+    creationTimeStamp = attributes['creationTimeStamp']
+    attributes['creationTimeStamp'] = frames.parse_creationTimeStamp(creationTimeStamp)
     
     if (modelName == 'ImageMetadata') and (attributes['frameNumber'] is None):        
-        index, frameNumbers = _cached_frameNumbers(root_path, rel_dir)        
+        if frameNumbers is None:
+            frameNumbers = _frame_index[os.path.join(root_path, rel_dir)]
         try:
-            key = (int(attributes['serialNumber']),)
-            try:
-                key = key + (datetime.strptime(attributes['creationTimeStamp'], '%Y%m%dT%H%M%S.%f'),)
-            except ValueError:
-                key = key + (datetime.strptime(attributes['creationTimeStamp'], '%Y%m%dT%H%M%S'),)                
-            i = utils.binary_search(index, key)
-            attributes['frameNumber'] = frameNumbers[i]
-        except ValueError:
+            key = int(attributes['serialNumber']), frames.stamp_microseconds(creationTimeStamp)
+            attributes['frameNumber'] = frameNumbers[key]
+        except KeyError:
             del attributes['frameNumber']
             warnings.warn('unable to find frameNumber for ImageMetadata: {}'.format(attributes), RuntimeWarning, 2)
         
@@ -80,111 +53,781 @@ def _xml2model(root_path, rel_path, session):
     else:
         del attributes['frameNumber']
     
-    try:
-        attributes['creationTimeStamp'] = datetime.strptime(attributes['creationTimeStamp'], '%Y%m%dT%H%M%S.%f')
-    except ValueError:
-        attributes['creationTimeStamp'] = datetime.strptime(attributes['creationTimeStamp'], '%Y%m%dT%H%M%S')
-
     attributes['serialNumber'] = int(attributes['serialNumber'])
-            
-    model = getattr(models, modelName)    
-    index = [index for index in models.inspector.get_indexes(model.__tablename__) 
-           if index['name'] == 'creationTimeStamp_serialNumber']
-    if len(index) != 1:
-        raise ValueError('index creationTimeStamp_serialNumber does not exist in table {}'.format(model.__tablename__))
-    index = index[0]['column_names']
-    instance = utils.read_or_instantiate(session, model, *index, **attributes)
+    return modelName, attributes
+
+
+@profiling.stages.timed('xml parse')
+def _parse_metadata(root_path, rel_path, modelName):
+    return metadata.parse(os.path.join(root_path, rel_path), modelName)
+
+
+@profiling.stages.timed('fk resolution')
+def _foreign_keys(model, serialNumber, creationTimeStamp, init_file_times, init_ids):
+    """
+    Resolves the foreign keys of a data row to the latest init record 
+    recorded before it, using the init_ids map instead of the database.
+    """
+    timestamp = init_file_times[serialNumber]
+    timestamp = timestamp[:bisect.bisect_left(timestamp, creationTimeStamp)]
+    timestamp = utils.take_closest(timestamp, creationTimeStamp)        
+    fk_ids = {}
+    for constrained_column, referred_table, referred_column in models.schemas[model.__name__].foreign_keys:
+        if referred_column != 'id':
+            raise ValueError('foreign keys must refer to the id column')
+        fk_ids[constrained_column] = init_ids[referred_table, serialNumber, timestamp]
+    return fk_ids
+
+
+@profiling.stages.timed('db lookup')
+def _existing_keys(session, table, keys):
+    """
+    Returns the subset of (creationTimeStamp, serialNumber) keys 
+    already stored in table using a single range query.
+    """
+    if not keys:
+        return set()
+    timestamps = [creationTimeStamp for creationTimeStamp, _ in keys]
+    query = session.query(table.c.creationTimeStamp, table.c.serialNumber)
+    query = query.filter(min(timestamps) <= table.c.creationTimeStamp,
+                         table.c.creationTimeStamp <= max(timestamps),
+                         table.c.serialNumber.in_({serialNumber for _, serialNumber in keys}))
+    return {tuple(row) for row in query} & set(keys)
+    
+    
+def _new_files(session, output_dir, data_files, frameNumbers=None):
+    """
+    Returns (modelName, file, attributes) of the files of a chunk that are 
+    not yet in the database, found from their names with one key query per 
+    table, grouped by modelName and sorted by key.
+    """
+    pending = {}
+    for f in data_files:
+        modelName, attributes = _parse_attributes(output_dir, f, frameNumbers)
+        key = attributes['creationTimeStamp'], attributes['serialNumber']
+        pending.setdefault(modelName, {})[key] = f, attributes
+    
+    new = []
+    for modelName, files in pending.iteritems():
+        model = models.schemas[modelName].model
+        keys = sorted(set(files) - _existing_keys(session, model.__table__, files.keys()))
+        new.extend((modelName,) + files[key] for key in keys)
+    return new
+
+
+def _xml2model(root_path, rel_path, session, frameNumbers=None, parsed=None):
+    """
+    Returns the stored instance of a file or a new one with its metadata. 
+    parsed is (modelName, attributes, metadata) of a file that was already 
+    read and is known not to be stored, which is instantiated without a lookup.
+    """
+    if parsed is None:
+        modelName, attributes = _parse_attributes(root_path, rel_path, frameNumbers)
+        metadata = None
+        schema = models.schemas[modelName]
+        with profiling.stages('db lookup'):
+            instance = utils.read_or_instantiate(session, schema.model, *schema.unique_index, **attributes)
+    else:
+        modelName, attributes, metadata = parsed
+        instance = models.schemas[modelName].model(**attributes)
     
     if not inspect(instance).persistent:
-        table = model.__table__    
-        try:
-            with open(os.path.join(root_path, rel_path), 'r') as fp:
-                root_node = etree.fromstring(fp.read())
-            root_node = root_node.find(modelName)
-            
-            for attribute in root_node:
-                column = getattr(table.columns, attribute.tag)
-                setattr(instance, attribute.tag, column.type.python_type(attribute.text))
-        except etree.XMLSyntaxError:
-            warnings.warn('unable to parse metadata for {}: {}'.format(modelName, attributes), RuntimeWarning, 2)
+        if metadata is None:
+            metadata = _parse_metadata(root_path, rel_path, modelName)
+        for name, value in metadata.iteritems():
+            setattr(instance, name, value)
     
     return instance
 
 
 def _commit_init_files(output_dir, init_fnames):
+    """
+    Returns a (table, serialNumber, creationTimeStamp) -> id map 
+    of the committed init records.
+    """
     pe.mp_print('_commit_init_files', len(init_fnames))
     session = models.Session()
     instances = [_xml2model(output_dir, f, session) for f in init_fnames]
-    index = {(inst.serialNumber, inst.creationTimeStamp) for inst in instances}
     session.add_all(inst for inst in instances if not inspect(inst).persistent)    
+    session.flush()
+    init_ids = {(inst.__tablename__, inst.serialNumber, inst.creationTimeStamp):inst.id for inst in instances}
     session.commit()
-    return index
+    return init_ids
 
 
-def _commit_data_files(output_dir, data_files, init_file_times):
+def _commit_data_files(output_dir, data_files, init_file_times, init_ids, frameNumbers=None, prefetch=0):
+    """
+    Commits the files of a chunk that are not yet in the database as ORM 
+    instances. With prefetch, the stored files are skipped by a key query 
+    per table first and a background thread reads and parses that many of 
+    the remaining files ahead of the database lookups.
+    """
     pe.mp_print('_commit_data_files', len(data_files))
     session = models.Session()
-    instances = (_xml2model(output_dir, f, session) for f in data_files)
+    if prefetch:
+        new = {f:(modelName, attributes) for modelName, f, attributes in _new_files(session, output_dir, data_files, frameNumbers)}
+        files = ((f,) + new[f] for f in data_files if f in new)
+        files = pe.prefetch(((f, (modelName, attributes, _parse_metadata(output_dir, f, modelName))) 
+                             for f, modelName, attributes in files), prefetch)
+        instances = (_xml2model(output_dir, f, session, frameNumbers, parsed) for f, parsed in files)
+    else:
+        instances = (_xml2model(output_dir, f, session, frameNumbers) for f in data_files)
     instances = [instance for instance in instances if not inspect(instance).persistent]
     for instance in instances:
-        timestamp = init_file_times[instance.serialNumber]
-        timestamp = timestamp[:bisect.bisect_left(timestamp, instance.creationTimeStamp)]
-        timestamp = utils.take_closest(timestamp, instance.creationTimeStamp)        
-        attributes = {'creationTimeStamp':timestamp, 'serialNumber':instance.serialNumber}        
-        for fk in models.inspector.get_foreign_keys(instance.__tablename__):
-            if len(fk['referred_columns']) != 1 or len(fk['constrained_columns']) != 1:
-                raise ValueError('composite foreign keys are not supported')
-            fk_model = getattr(models, fk['referred_table'])
-            fk_instance = session.query(fk_model).filter_by(**attributes).one()
-            fk_id = getattr(fk_instance, fk['referred_columns'][0])
-            setattr(instance, fk['constrained_columns'][0], fk_id)
-    session.add_all(instances)
-    session.commit()
+        fk_ids = _foreign_keys(type(instance), instance.serialNumber, instance.creationTimeStamp, 
+                               init_file_times, init_ids)
+        for name, value in fk_ids.iteritems():
+            setattr(instance, name, value)
+    with profiling.stages('flush/commit', len(instances)):
+        session.add_all(instances)
+        session.commit()
+    return len(instances)
+    
+    
+def _new_rows(session, output_dir, data_files, init_file_times, init_ids, frameNumbers=None, prefetch=0):
+    """
+    Yields (modelName, row) for the files of a chunk that are not yet in 
+    the database, with foreign keys resolved. Existing rows are found with 
+    one key query per table before the first row is yielded. With prefetch, 
+    a background thread reads and parses the metadata of that many files 
+    ahead of the consumer.
+    """
+    new = _new_files(session, output_dir, data_files, frameNumbers)
+    def read():
+        for modelName, f, attributes in new:
+            attributes.update(_parse_metadata(output_dir, f, modelName))
+            yield modelName, attributes
+    for modelName, attributes in pe.prefetch(read(), prefetch):
+        attributes.update(_foreign_keys(models.schemas[modelName].model, attributes['serialNumber'], 
+                                        attributes['creationTimeStamp'], init_file_times, init_ids))
+        yield modelName, attributes
+        
+        
+def _parse_data_files(output_dir, data_files, init_file_times, init_ids, frameNumbers=None, prefetch=0):
+    """
+    Parses the files of a chunk that are not yet in the database into 
+    {modelName: [row]} with foreign keys resolved.
+    """
+    session = models.Session()
+    rows = {}
+    for modelName, row in _new_rows(session, output_dir, data_files, init_file_times, init_ids, frameNumbers, prefetch):
+        rows.setdefault(modelName, []).append(row)
+    session.rollback()
+    return rows
+
+
+def _run_batch(f, output_dir, data_files, *args):
+    """
+    Runs f on one batch of data files in an ingest process and returns 
+    (process id, seconds, number of files, stages, cache counts, result) so 
+    that slow batches can be traced back to their process and the stage 
+    timings and cache hits and misses of the process can be merged by the 
+    parent.
+    """
+    t = time.time()
+    result = f(output_dir, data_files, *args)
+    t = time.time() - t
+    caches = {name:cache.drain() for name, cache in _caches.iteritems()}
+    return mp.current_process().ident, t, len(data_files), profiling.stages.drain(), caches, result
+
+
+def _merge_batch(batch_stages, batch_caches):
+    'Merges the stages and cache counts returned by _run_batch into those of this process'
+    profiling.stages.merge(batch_stages)
+    for name, drained in batch_caches.iteritems():
+        _caches[name].merge(drained)
+
+
+def _report_batches(timings):
+    'Summarizes (process id, seconds, number of files) of the batches of a directory'
+    if not timings:
+        return
+    seconds = np.array([t for _, t, _ in timings])
+    pid, slowest, n = max(timings, key=lambda timing: timing[1])
+    print '{} batches: {} seconds median, {} seconds max ({} files on P={})'.format(len(timings), np.median(seconds), 
+                                                                                   slowest, n, pid)
+
+
+@profiling.stages.timed('flush/commit')
+def _insert_rows(session, rows):
+    """
+    Inserts {modelName: [row]} with one executemany per table 
+    and returns the number of rows.
+    """
+    count = 0
+    for modelName, table_rows in rows.iteritems():
+        # executemany compiles one statement for every row, so all rows need the same keys
+        names = {name for row in table_rows for name in row}
+        session.execute(models.schemas[modelName].model.__table__.insert(), 
+                        [{name:row.get(name) for name in names} for row in table_rows])
+        count += len(table_rows)
+    return count
+
     
+def _bulk_commit_data_files(output_dir, data_files, init_file_times, init_ids, frameNumbers=None, prefetch=0):
+    """
+    Same result as _commit_data_files, but diffs the chunk against one 
+    key query per table and writes new rows with executemany INSERTs 
+    instead of a SELECT per file and ORM instances.
+    """
+    pe.mp_print('_bulk_commit_data_files', len(data_files))
+    session = models.Session()
+    count = _insert_rows(session, _parse_data_files(output_dir, data_files, init_file_times, init_ids, frameNumbers, prefetch))
+    with profiling.stages('flush/commit', 0):
+        session.commit()
+    return count
+    
+
+def _scan_data_files(root_path, rel_dir, batch_size):
+    """
+    Yields the xml files of rel_dir in batches of batch_size 
+    while the directory is still being listed.
+    """
+    data_files = (os.path.join(rel_dir, entry.name) for entry in utils.scandir(os.path.join(root_path, rel_dir))
+                  if os.path.splitext(entry.name)[1] == '.xml')
+    return utils.batches(profiling.stages.iterate('listing', data_files), batch_size)
+        
+        
+def _ingest_data_files(par, output_dir, rel_dir, init_file_times, init_ids, frameNumbers, 
+                       bulk, stream, batch_size, commit_interval, prefetch):
+    """
+    Dispatches the xml files of rel_dir as batches of batch_size files to 
+    the processes of par as they are listed, so idle processes pick up the 
+    next batch instead of waiting on a straggler. At most a few batches 
+    are in flight, so memory does not depend on the size of the directory.
+    
+    With stream, the processes only parse and this process inserts the 
+    results, committing every commit_interval batches. Otherwise each 
+    process commits its own batches. Within a batch, each process reads 
+    and parses prefetch files ahead of its database work. Returns 
+    (items, rows).
+    """
+    if stream:
+        f = _parse_data_files
+    else:
+        f = _bulk_commit_data_files if bulk else _commit_data_files
+    batches = (pe.delayed(_run_batch)(f, output_dir, data_files, init_file_times, init_ids, frameNumbers, prefetch)
+               for data_files in _scan_data_files(output_dir, rel_dir, batch_size))
+    session = models.Session()
+    items = count = 0
+    timings = []
+    for i, (pid, seconds, n, batch_stages, batch_caches, result) in enumerate(par.imap_unordered(batches), 1):
+        timings.append((pid, seconds, n))
+        _merge_batch(batch_stages, batch_caches)
+        items += n
+        if stream:
+            count += _insert_rows(session, result)
+            if i % commit_interval == 0:
+                with profiling.stages('flush/commit', 0):
+                    session.commit()
+        else:
+            count += result
+    with profiling.stages('flush/commit', 0):
+        session.commit()
+    _report_batches(timings)
+    return items, count
+    
+
+class _SavedMap(object):
+    """
+    Picklable handle to a dict pickled to path, which each ingest process 
+    loads once on first use, like frames.SavedFrameNumbers. Used for maps 
+    that only exist once the pool is running, so pe.Local cannot ship them.
+    """
+    _loaded = {}
+    
+    def __init__(self, obj, path):
+        with open(path, 'wb') as fp:
+            cPickle.dump(obj, fp, cPickle.HIGHEST_PROTOCOL)
+        self.path = path
+    def __getitem__(self, key):
+        try:
+            obj = self._loaded[self.path]
+        except KeyError:
+            with open(self.path, 'rb') as fp:
+                obj = self._loaded[self.path] = cPickle.load(fp)
+        return obj[key]
+
+
+def _init_ingest_worker(profile_dir=None):
+    """
+    Pool initializer of the ingest processes. Each process opens its own 
+    database connection once and keeps it for all of its tasks and, with 
+    profile_dir, runs cProfile until it exits.
+    """
+    # the session and pool copied by fork are dropped without touching the connections they share with the parent
+    models.Session.registry.clear()
+    models.engine.pool = models.engine.pool.recreate()
+    models.engine.connect().close()
+    # stages and cache counts of the parent copied by fork
+    profiling.stages.drain()
+    for cache in _caches.itervalues():
+        cache.drain()
+    if profile_dir:
+        profiling.profile(profile_dir, 'populate_db')
+    
+    
+def _directory_state(root_path, rel_dir):
+    """
+    Returns the number of xml files in rel_dir and their 
+    latest modification time in integer microseconds.
+    """
+    fileCount, maxMTime = 0, 0
+    for entry in utils.scandir(os.path.join(root_path, rel_dir)):
+        if os.path.splitext(entry.name)[1] == '.xml':
+            fileCount += 1
+            maxMTime = max(maxMTime, long(round(entry.stat().st_mtime * 10 ** 6)))
+    return fileCount, maxMTime
+
+
+# frames this far from a directory are rematched with it, so that pairs across directory boundaries are settled
+_pair_margin = 10 * 10 ** 6
+
+
+def _stereo_rig(session, serial_numbers):
+    """
+    Returns the StereoRig of the two serial_numbers in either order and 
+    whether they are reversed with respect to it, or (None, False), also 
+    on databases created before the StereoRig table existed.
+    """
+    if not models.engine.has_table(models.StereoRig.__tablename__):
+        return None, False
+    serialNumber0, serialNumber1 = serial_numbers
+    rig = session.query(models.StereoRig).filter(or_(
+              and_(models.StereoRig.serialNumber0 == serialNumber0, models.StereoRig.serialNumber1 == serialNumber1),
+              and_(models.StereoRig.serialNumber0 == serialNumber1, models.StereoRig.serialNumber1 == serialNumber0))).first()
+    if rig is None:
+        return None, False
+    return rig, rig.serialNumber0 != serialNumber0
+
+
+def _materialize_pairs(session, rig, start, stop):
+    """
+    Replaces the StereoPairs of rig whose first frame lies in [start, stop) 
+    by matching the frames of both cameras within _pair_margin of it, the 
+    same way find_pairs does on the fly. Returns the number of pairs.
+    """
+    table, pairs = models.ImageMetadata.__table__, models.StereoPair.__table__
+    creationTimeStamp = models.MicrosecondTimestamp.column_raw(table.c.creationTimeStamp)
+    begin, end = utils.microseconds(start), utils.microseconds(stop)
+    ids, timestamps = [], []
+    for serialNumber in (rig.serialNumber0, rig.serialNumber1):
+        query = select([table.c.id, creationTimeStamp])
+        query = query.where(and_(table.c.serialNumber == serialNumber,
+                                 begin - _pair_margin <= creationTimeStamp,
+                                 creationTimeStamp < end + _pair_margin))
+        rows = session.execute(query.order_by(table.c.creationTimeStamp)).fetchall()
+        ids.append(np.array([row[0] for row in rows], np.int64))
+        timestamps.append(np.array([row[1] for row in rows], np.int64))
+    i0, i1, _ = matching.match_pairs(*timestamps)
+    keep = (begin <= timestamps[0][i0]) & (timestamps[0][i0] < end)
+    i0, i1 = i0[keep], i1[keep]
+    
+    pairsTimeStamp = models.MicrosecondTimestamp.column_raw(pairs.c.creationTimeStamp)
+    session.execute(pairs.delete().where(and_(pairs.c.StereoRig_id == rig.id, 
+                                              begin <= pairsTimeStamp, pairsTimeStamp < end)))
+    if len(i0):
+        session.execute(pairs.insert(), [{'StereoRig_id':rig.id,
+                                          'creationTimeStamp':long(t0),
+                                          'offset':long(t1 - t0),
+                                          'ImageMetadata0_id':long(id0),
+                                          'ImageMetadata1_id':long(id1)}
+                                         for t0, t1, id0, id1 in zip(timestamps[0][i0], timestamps[1][i1], 
+                                                                     ids[0][i0], ids[1][i1])])
+    session.commit()
+    return len(i0)
+
+
+def _register_rigs(session, rigs):
+    'Adds the StereoRigs of rigs that do not exist yet'
+    for serial_numbers in rigs:
+        serial_numbers = [int(s) for s in serial_numbers]
+        if _stereo_rig(session, serial_numbers)[0] is None:
+            session.add(models.StereoRig(serialNumber0=serial_numbers[0], serialNumber1=serial_numbers[1]))
+    session.commit()
+
+
+def _materialized_hours(session, rig, start, stop):
+    'Starts of the hours in [start, stop) that the StereoPairLedger records as materialized for rig'
+    ledger = models.StereoPairLedger.__table__
+    query = select([ledger.c.creationTimeStamp]).where(and_(ledger.c.StereoRig_id == rig.id, 
+                                                            start <= ledger.c.creationTimeStamp, 
+                                                            ledger.c.creationTimeStamp < stop))
+    return {row[0] for row in session.execute(query)}
+
+
+def _materialize_directory_pairs(session, rigs, hour, missing_only=False):
+    """
+    Rematches the StereoPairs of rigs around the hour directory starting at 
+    hour and records it in the StereoPairLedger. With missing_only, rigs 
+    the ledger records as materialized for hour are skipped.
+    """
+    margin = timedelta(microseconds=_pair_margin)
+    for rig in rigs:
+        materialized = _materialized_hours(session, rig, hour, hour + timedelta(hours=1))
+        if missing_only and materialized:
+            continue
+        t = time.time()
+        with profiling.stages('pairs'):
+            n = _materialize_pairs(session, rig, hour - margin, hour + timedelta(hours=1) + margin)
+        if not materialized:
+            session.add(models.StereoPairLedger(StereoRig_id=rig.id, creationTimeStamp=hour))
+            session.commit()
+        print '{} pairs of rig {} {} materialized in {} seconds'.format(n, rig.serialNumber0, rig.serialNumber1, time.time() - t)
+
+
+def _covers(session, rig, data_dir, start, stop):
+    """
+    Whether the StereoPairs of rig have been materialized for every hour 
+    directory of data_dir that overlaps [start, stop), so that a rig 
+    registered after some directories were loaded, or a run interrupted 
+    before reaching them, falls back to matching on the fly.
+    """
+    if not models.engine.has_table(models.StereoPairLedger.__tablename__):
+        return False
+    first = start.replace(minute=0, second=0, microsecond=0)
+    hours = {frames.parse_hour_directory(d) for d in frames.hour_directories(data_dir)}
+    hours = {hour for hour in hours if first <= hour < stop}
+    return hours <= _materialized_hours(session, rig, first, stop)
+
 
 @click.command()
 @click.option('--data_dir', help='root directory where images and metadata were captured', required=True)
 @click.option('--recreate', help='drops all data and the schema in the database and recreates schema', is_flag=True)    
-def populate_db(data_dir, recreate):
+@click.option('--partition_days', help='with --recreate, first and last day formatted as %Y-%m-%d to range partition ImageMetadata by on MySQL', nargs=2)    
+@click.option('--bulk', help='diffs each chunk against existing keys and inserts new rows with executemany', is_flag=True)    
+@click.option('--stream', help='parses batches in the ingest processes and inserts them with a single bulk writer', is_flag=True)    
+@click.option('--batch_size', help='number of files per ingest batch', default=1000)    
+@click.option('--commit_interval', help='number of batches per commit when streaming', default=1)    
+@click.option('--incremental', help='skips directories the ingest ledger records as loaded and unchanged', is_flag=True)    
+@click.option('--workers', help='number of ingest processes, defaults to the number of CPUs', type=int)    
+@click.option('--prefetch', help='number of files each ingest process reads and parses ahead of its database work, 0 to disable', 
+              default=32)    
+@click.option('--profile', help='directory where cProfile stats of every ingest process are dumped')    
+@click.option('--rig', help='serial numbers of a stereo rig whose pairs are materialized for find_pairs, repeated for each rig; '
+                            'registered rigs are kept up to date by later runs', nargs=2, multiple=True)    
+def populate_db(data_dir, recreate, partition_days, bulk, stream, batch_size, commit_interval, incremental, workers, prefetch, profile, rig):
+    if partition_days:
+        if not recreate:
+            raise click.BadParameter('partitions are only created together with --recreate', param_hint='--partition_days')
+        if models.engine.dialect.name != 'mysql':
+            raise click.BadParameter('partitioning is only supported on MySQL', param_hint='--partition_days')
+        partition_days = [datetime.strptime(day, '%Y-%m-%d') for day in partition_days]
     if recreate and click.confirm('Are you sure you want to delete all data in the database?', abort=True):
-        models.recreate()
+        models.recreate(partition_days)
     
+    if profile:
+        if not os.path.isdir(profile):
+            os.makedirs(profile)
+        profiling.profile(profile, 'populate_db')
+    models.create_missing(models.StereoRig, models.StereoPair, models.StereoPairLedger)
+    if incremental:
+        models.create_missing(models.IngestLedger)
+    workers = workers or mp.cpu_count()
     init_fnames = [f for f in sorted(os.listdir(data_dir)) 
                    if os.path.splitext(f)[1] == '.xml']
-    t = time.time()
-    index = joblib.Parallel(-1)(joblib.delayed(_commit_init_files)(data_dir, fnames) 
-                      for fnames in utils.partition(init_fnames, mp.cpu_count()))
-    t = time.time() - t
-    print '{} items / {} seconds = {} items per second'.format(len(init_fnames), t, len(init_fnames) / t)    
+    data_dirnames = frames.hour_directories(data_dir)
     
-    init_timestamps = {}
-    index = sorted({v for i in index for v in i})    
-    for serialNumber, creationTimeStamp in index:
-        try:
-            init_timestamps[serialNumber].append(creationTimeStamp)
-        except KeyError:
-            init_timestamps[serialNumber] = [creationTimeStamp]
-    
-    data_dirnames = [os.path.join(d1, d2) 
-                     for d1 in sorted(os.listdir(data_dir)) 
-                     if os.path.isdir(os.path.join(data_dir, d1))
-                     for d2 in sorted(os.listdir(os.path.join(data_dir, d1))) 
-                     if os.path.isdir(os.path.join(data_dir, d1, d2))]
-    
-    for d in data_dirnames:
-        print datetime.strptime(d, '%Y%m%d\\%H')        
+    # memory mapped or loaded once by the ingest processes instead of being pickled with every task
+    frames_dir = tempfile.mkdtemp()
+    session = models.Session()
+    _register_rigs(session, rig)
+    rigs = session.query(models.StereoRig).all()
+    total_items, total_rows, total_t = 0, 0, time.time()
+    try:
+        # connections must not be shared with the forked ingest processes
+        models.Session.remove()
+        models.engine.dispose()
+        with pe.ParFor(workers, _init_ingest_worker, (profile,)) as par:
+            t = time.time()
+            batches = par(pe.delayed(_run_batch)(_commit_init_files, data_dir, fnames) 
+                          for fnames in utils.batches(init_fnames, batch_size))
+            t = time.time() - t
+            print '{} items / {} seconds = {} items per second'.format(len(init_fnames), t, len(init_fnames) / t)    
+            
+            init_ids = {}
+            for _, _, _, batch_stages, batch_caches, result in batches:
+                _merge_batch(batch_stages, batch_caches)
+                init_ids.update(result)
+            init_timestamps = {}
+            index = sorted({(serialNumber, creationTimeStamp) for _, serialNumber, creationTimeStamp in init_ids})    
+            for serialNumber, creationTimeStamp in index:
+                try:
+                    init_timestamps[serialNumber].append(creationTimeStamp)
+                except KeyError:
+                    init_timestamps[serialNumber] = [creationTimeStamp]
+            init_timestamps = _SavedMap(init_timestamps, os.path.join(frames_dir, 'init_timestamps.pickle'))
+            init_ids = _SavedMap(init_ids, os.path.join(frames_dir, 'init_ids.pickle'))
+            
+            session = models.Session()
+            for d in data_dirnames:
+                hour = frames.parse_hour_directory(d)
+                print hour
+                
+                if incremental:
+                    directory = d.replace(os.sep, '/')
+                    with profiling.stages('listing', 0):
+                        fileCount, maxMTime = _directory_state(data_dir, d)
+                    ledger = session.query(models.IngestLedger).filter_by(directory=directory).first()
+                    if ledger is None:
+                        ledger = models.IngestLedger(directory=directory)
+                        session.add(ledger)
+                    elif (ledger.status, ledger.fileCount, ledger.maxMTime) == ('loaded', fileCount, maxMTime):
+                        print 'already loaded'
+                        _materialize_directory_pairs(session, rigs, hour, missing_only=True)
+                        continue
+                    # rows committed by an interrupted run are skipped by the existing key diff
+                    ledger.fileCount, ledger.maxMTime, ledger.status = fileCount, maxMTime, 'loading'
+                    session.commit()
+                
+                t = time.time()
+                with profiling.stages('frame index'):
+                    frameNumbers = _frame_index[os.path.join(data_dir, d)]
+                frameNumbers = frameNumbers.save(os.path.join(frames_dir, d.replace(os.sep, '_') + '.npy'))
+                items, rows = _ingest_data_files(par, data_dir, d, init_timestamps, init_ids, frameNumbers, 
+                                                 bulk, stream, batch_size, commit_interval, prefetch)
+                t = time.time() - t
+                print '{} items / {} seconds = {} items per second'.format(items, t, items / t)
+                print '{} rows / {} seconds = {} rows per second'.format(rows, t, rows / t)
+                total_items, total_rows = total_items + items, total_rows + rows
+                _materialize_directory_pairs(session, rigs, hour)
+                
+                if incremental:
+                    ledger.status = 'loaded'
+                    session.commit()
+    finally:
+        shutil.rmtree(frames_dir)
+    # seconds per stage are summed over all processes and can exceed the wall clock seconds
+    print json.dumps({'items':total_items, 'rows':total_rows, 'seconds':time.time() - total_t, 
+                      'stages':profiling.stages.to_dict(), 
+                      'caches':{name:{'hits':cache.hits, 'misses':cache.misses} for name, cache in _caches.iteritems()}}, 
+                     sort_keys=True)
         
-        data_files = [os.path.join(d, f)
-                      for f in sorted(os.listdir(os.path.join(data_dir, d)))
-                      if os.path.splitext(f)[1] == '.xml']
+
+def _fetch_frames(session, start, stop, serial_numbers, chunk_size):
+    """
+    Streams (creationTimeStamp, serialNumber, frameNumber) of the 
+    ImageMetadata rows in [start, stop) through a server side cursor in 
+    chunks of chunk_size rows, ordered by creationTimeStamp. Timestamps are 
+    fetched as raw integer microseconds instead of datetimes.
+    """
+    table = models.ImageMetadata.__table__
+    creationTimeStamp = models.MicrosecondTimestamp.column_raw(table.c.creationTimeStamp)
+    query = select([creationTimeStamp, table.c.serialNumber, table.c.frameNumber])
+    query = query.where(and_(utils.microseconds(start) <= creationTimeStamp,
+                             creationTimeStamp < utils.microseconds(stop),
+                             table.c.serialNumber.in_(serial_numbers)))
+    query = query.order_by(table.c.creationTimeStamp)
+    result = session.execute(query.execution_options(stream_results=True))
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        timestamps, serialNumbers, frameNumbers = zip(*rows)
+        yield (np.array(timestamps, np.int64), 
+               np.array(serialNumbers, np.int64), 
+               np.array(frameNumbers, object))
         
-        t = time.time()
-        index = joblib.Parallel(-1)(joblib.delayed(_commit_data_files)(data_dir, fnames, init_timestamps) 
-                          for fnames in utils.partition(data_files, mp.cpu_count()))
-        t = time.time() - t
-        print '{} items / {} seconds = {} items per second'.format(len(data_files), t, len(data_files) / t)
         
+class _ImagePaths(object):
+    """
+    Builds the image paths of frames from their serial number, timestamp in 
+    microseconds and frame number. With verify, counts the images that do 
+    not exist against a listing of the .jpg names of each YYYYMMDD/HH 
+    directory instead of a stat per image. Frames arrive in time order, so 
+    only the listings of the current and previous directory are kept.
+    """
+    def __init__(self, root_path, seperator, verify=True):
+        self.root_path = root_path
+        self.seperator = seperator
+        self.verify = verify
+        self.images = 0
+        self.missing = 0
+        self._second = None
+        self._listings = frames.FrameIndex(maxsize=2, load=self._listing)
+        
+    @staticmethod
+    def _listing(directory):
+        try:
+            return frozenset(entry.name for entry in utils.scandir(directory) 
+                             if os.path.splitext(entry.name)[1] == '.jpg')
+        except OSError:
+            return frozenset()
+    def __call__(self, serialNumber, timestamp, frameNumber):
+        second, microsecond = divmod(int(timestamp), 10 ** 6)
+        # frames arrive in time order, so the formatted second rarely changes
+        if second != self._second:
+            stamp = utils.from_microseconds(second * 10 ** 6).strftime('%Y%m%dT%H%M%S')
+            self._second, self._stamp = second, stamp
+            self._directory = os.path.join(self.root_path, stamp[:8], stamp[9:11])
+        # the capture leaves out the fraction on a whole second, which is why file names 
+        # have always been parsed with %Y%m%dT%H%M%S as well as %Y%m%dT%H%M%S.%f
+        stamp = self._stamp + '.%06d' % microsecond if microsecond else self._stamp
+        fname = self.seperator.join((stamp, str(serialNumber), str(frameNumber))) + '.jpg'
+        if self.verify:
+            self.images += 1
+            if fname not in self._listings[self._directory]:
+                self.missing += 1
+        return os.path.join(self._directory, fname)
+    
+
+def _write_matches(chunks, serial_numbers, paths, out_file, max_offset):
+    """
+    Streams chunks of frames of serial_numbers, as yielded by _fetch_frames 
+    or CaptureIndex.frames, through a TupleMatcher and writes the image 
+    paths built by paths of each synchronized tuple as a CSV row. Returns 
+    the TupleMatcher, the frame count per serial number and the number of 
+    rows written.
+    """
+    counts = dict.fromkeys(serial_numbers, 0)
+    matcher = matching.TupleMatcher(len(serial_numbers), max_offset)
+    with open(out_file, 'w+') as fp:
+        writer = csv.writer(fp, lineterminator='\n')
+        written = 0
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is None:
+                ts, ps = matcher.finish()
+            else:
+                timestamps, serialNumbers, frameNumbers = chunk
+                masks = [serialNumbers == serialNumber for serialNumber in serial_numbers]
+                for serialNumber, mask in zip(serial_numbers, masks):
+                    counts[serialNumber] += np.count_nonzero(mask)
+                ts, ps = matcher.update([timestamps[mask] for mask in masks], [frameNumbers[mask] for mask in masks])
+            written += _write_rows(writer, paths, serial_numbers, ts, ps)
+    return matcher, counts, written
+    
+    
+def _fetch_clocks(session, start, stop, serial_numbers, chunk_size):
+    """
+    Returns {serialNumber: (creationTimeStamp, embeddedTimeStamp, frameNumber)} 
+    int64 arrays of the ImageMetadata rows in [start, stop) that have an 
+    embeddedTimeStamp, ordered by creationTimeStamp.
+    """
+    table = models.ImageMetadata.__table__
+    creationTimeStamp = models.MicrosecondTimestamp.column_raw(table.c.creationTimeStamp)
+    query = select([table.c.serialNumber, creationTimeStamp, table.c.embeddedTimeStamp, table.c.frameNumber])
+    query = query.where(and_(utils.microseconds(start) <= creationTimeStamp,
+                             creationTimeStamp < utils.microseconds(stop),
+                             table.c.serialNumber.in_(serial_numbers),
+                             table.c.embeddedTimeStamp != None))
+    result = session.execute(query.order_by(table.c.creationTimeStamp).execution_options(stream_results=True))
+    chunks = []
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunks.append(np.array(rows, np.int64))
+    rows = np.concatenate(chunks) if chunks else np.zeros((0, 4), np.int64)
+    return {serialNumber:tuple(rows[rows[:, 0] == serialNumber, 1:].T) for serialNumber in serial_numbers}
+
+
+def _write_clock_matches(session, start, stop, serial_numbers, paths, out_file, max_offset, chunk_size, embedded_clock):
+    """
+    Fits a ClockModel to the frames of each camera in [start, stop) and 
+    matches them like _write_matches, but on their embeddedTimeStamps 
+    mapped to the host timeline, which is free of the scheduling jitter 
+    of creationTimeStamps. embedded_clock is either cycle, for IEEE 1394 
+    cycle time stamps, or microseconds. Returns the ClockModel, frame 
+    count per serial number, TupleMatcher and number of rows written.
+    """
+    cameras = _fetch_clocks(session, start, stop, serial_numbers, chunk_size)
+    clocks, ts, ps = {}, [], []
+    for serialNumber in serial_numbers:
+        host, embedded, frameNumbers = cameras[serialNumber]
+        if embedded_clock == 'cycle':
+            embedded = matching.cycle_time_microseconds(embedded, host)
+        clocks[serialNumber] = matching.ClockModel(host, embedded)
+        corrected = clocks[serialNumber](embedded)
+        order = np.argsort(corrected, kind='mergesort')
+        # the matcher carries the row index to recover the creationTimeStamp of the file name
+        ts.append(corrected[order])
+        ps.append(order)
+    matcher = matching.TupleMatcher(len(serial_numbers), max_offset)
+    matched = [matcher.update(ts, ps), matcher.finish()]
+    with open(out_file, 'w+') as fp:
+        writer = csv.writer(fp, lineterminator='\n')
+        written = 0
+        for _, indices in matched:
+            indices = [i.astype(np.intp) for i in indices]
+            hosts = [cameras[serialNumber][0][i] for serialNumber, i in zip(serial_numbers, indices)]
+            frameNumbers = [cameras[serialNumber][2][i] for serialNumber, i in zip(serial_numbers, indices)]
+            written += _write_rows(writer, paths, serial_numbers, hosts, frameNumbers)
+    counts = {serialNumber:len(cameras[serialNumber][0]) for serialNumber in serial_numbers}
+    return clocks, counts, matcher, written
+
+
+def _report_clocks(clocks, serial_numbers, written, counts):
+    'Prints the fitted drift of each camera and the share of possible matches found'
+    for serialNumber in serial_numbers:
+        clock = clocks[serialNumber]
+        print '{}: drift {} ppm, jitter {} microseconds, fitted to {} of {} frames'.format(
+                  serialNumber, clock.drift, clock.jitter, clock.inliers, counts[serialNumber])
+    print 'match rate {}'.format(float(written) / max(min(counts.values()), 1))
+
+
+def _write_rows(writer, paths, serial_numbers, ts, ps):
+    """
+    Writes the image paths of matched frames as CSV rows, given their 
+    timestamps ts and frame numbers ps per serial number. Returns the 
+    number of rows written. Paths are built row by row, in time order, 
+    which the directory listings cached by paths rely on.
+    """
+    cameras = zip(serial_numbers, ts, ps)
+    writer.writerows([paths(serialNumber, t[i], p[i]) for serialNumber, t, p in cameras] 
+                     for i in xrange(len(ts[0])))
+    return len(ts[0])
+
+
+def _write_materialized_pairs(session, rig, reversed_, start, stop, paths, out_file, max_offset, chunk_size):
+    """
+    Writes the StereoPairs of rig with both frames in [start, stop) with 
+    one range scan, in the order of serial_numbers given to find_pairs. 
+    Unlike on the fly matching, frames near start and stop are paired 
+    as they were with frames outside of the range, or not at all if 
+    their pair lies outside. Returns the number of rows written.
+    """
+    pairs = models.StereoPair.__table__
+    frames0, frames1 = models.ImageMetadata.__table__.alias(), models.ImageMetadata.__table__.alias()
+    raw = models.MicrosecondTimestamp.column_raw
+    begin, end = utils.microseconds(start), utils.microseconds(stop)
+    query = select([raw(frames0.c.creationTimeStamp), raw(frames1.c.creationTimeStamp), 
+                    frames0.c.frameNumber, frames1.c.frameNumber])
+    query = query.select_from(pairs.join(frames0, frames0.c.id == pairs.c.ImageMetadata0_id)
+                                   .join(frames1, frames1.c.id == pairs.c.ImageMetadata1_id))
+    conditions = [pairs.c.StereoRig_id == rig.id, 
+                  begin <= raw(pairs.c.creationTimeStamp), raw(pairs.c.creationTimeStamp) < end,
+                  begin <= raw(pairs.c.creationTimeStamp) + pairs.c.offset, 
+                  raw(pairs.c.creationTimeStamp) + pairs.c.offset < end]
+    if max_offset is not None:
+        conditions.append(func.abs(pairs.c.offset) <= max_offset)
+    query = query.where(and_(*conditions)).order_by(pairs.c.creationTimeStamp)
+    result = session.execute(query.execution_options(stream_results=True))
+    serial_numbers = [rig.serialNumber0, rig.serialNumber1]
+    if reversed_:
+        serial_numbers.reverse()
+    with open(out_file, 'w+') as fp:
+        writer = csv.writer(fp, lineterminator='\n')
+        written = 0
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            t0, t1, p0, p1 = zip(*rows)
+            ts, ps = [t0, t1], [p0, p1]
+            if reversed_:
+                ts.reverse()
+                ps.reverse()
+            written += _write_rows(writer, paths, serial_numbers, ts, ps)
+    return written
+    
 
+def _report_missing(paths):
+    if paths.verify:
+        print '{} of {} image paths written do not exist'.format(paths.missing, paths.images)
+        if paths.missing:
+            warnings.warn('{} computed image paths do not exist'.format(paths.missing))
+    
+    
 @click.command()
 @click.option('--start', help='starting datetime formatted as %Y-%m-%d %H:%M:%S.%f', required=True)    
 @click.option('--stop', help='stopping datetime formatted as %Y-%m-%d %H:%M:%S.%f', required=True)    
@@ -192,57 +835,141 @@ def populate_db(data_dir, recreate):
 @click.option('--serial_numbers', help='serial numbers for each camera in stereo pair', nargs=2, required=True)    
 @click.option('--data_dir', help='root directory where images and metadata were captured', required=True)    
 @click.option('--out_file', help='output file name where paths to stereo pairs are written', required=True)    
-def find_pairs(start, stop, seperator, serial_numbers, data_dir, out_file):
+@click.option('--max_offset', help='maximum offset in microseconds between the frames of a pair', type=int)    
+@click.option('--chunk_size', help='number of rows fetched from the database at a time', default=100000)    
+@click.option('--verify/--no-verify', help='counts the image paths written that do not exist', default=True)    
+@click.option('--index_dir', help='frame index written by the index command to match against instead of the database')    
+@click.option('--embedded_clock', help='matches on embeddedTimeStamps, either IEEE 1394 cycle time stamps or microseconds, '
+                                       'mapped to the host clock by a linear fit per camera', type=click.Choice(['cycle', 'microseconds']))    
+def find_pairs(start, stop, seperator, serial_numbers, data_dir, out_file, max_offset, chunk_size, verify, index_dir, embedded_clock):
+    start = datetime.strptime(start, '%Y-%m-%d %H:%M:%S.%f') 
+    stop = datetime.strptime(stop, '%Y-%m-%d %H:%M:%S.%f') 
+    serial_numbers = [int(s) for s in serial_numbers]
+    
+    if index_dir and embedded_clock:
+        raise click.BadParameter('the frame index has no embeddedTimeStamps', param_hint='--embedded_clock')
+    
+    t = time.time()
+    paths = _ImagePaths(data_dir, seperator, verify)
+    clocks = None
+    if index_dir:
+        rig, chunks = None, frames.CaptureIndex(index_dir).frames(start, stop, serial_numbers)
+    else:
+        session = models.Session()    
+        rig, reversed_ = _stereo_rig(session, serial_numbers)
+        if rig is not None and not _covers(session, rig, data_dir, start, stop):
+            rig = None
+        chunks = _fetch_frames(session, start, stop, serial_numbers, chunk_size)
+    if embedded_clock:
+        clocks, counts, matcher, written = _write_clock_matches(session, start, stop, serial_numbers, paths, 
+                                                                out_file, max_offset, chunk_size, embedded_clock)
+    elif rig is not None:
+        # frames are not counted, which would take a second scan over ImageMetadata
+        counts = None
+        written = _write_materialized_pairs(session, rig, reversed_, start, stop, 
+                                            paths, out_file, max_offset, chunk_size)
+    else:
+        matcher, counts, written = _write_matches(chunks, serial_numbers, paths, out_file, max_offset)
+        mismatches = matcher.matchers[0].mismatches
+        if mismatches:
+            warnings.warn('{} backtracking mismatches'.format(mismatches))
+    if counts is not None:
+        print '{} potential pairs selected'.format(sum(counts.values()) / 2)
+        print '{} maximum possible pairs'.format(min(counts.values()))
+    print '{} pairs written to disk in {} seconds'.format(written, time.time() - t)
+    if clocks is not None:
+        _report_clocks(clocks, serial_numbers, written, counts)
+    _report_missing(paths)
+    
+    
+@click.command()
+@click.option('--start', help='starting datetime formatted as %Y-%m-%d %H:%M:%S.%f', required=True)    
+@click.option('--stop', help='stopping datetime formatted as %Y-%m-%d %H:%M:%S.%f', required=True)    
+@click.option('--seperator', help='seperator used in file names: either "." or "_"', required=True)    
+@click.option('--serial_numbers', help='serial number of a camera in the rig, repeated for each camera; the first is the reference', 
+              multiple=True, required=True)    
+@click.option('--data_dir', help='root directory where images and metadata were captured', required=True)    
+@click.option('--out_file', help='output file name where paths to synchronized tuples are written', required=True)    
+@click.option('--max_offset', help='maximum offset in microseconds between a frame and the reference frame', type=int)    
+@click.option('--chunk_size', help='number of rows fetched from the database at a time', default=100000)    
+@click.option('--verify/--no-verify', help='counts the image paths written that do not exist', default=True)    
+@click.option('--index_dir', help='frame index written by the index command to match against instead of the database')    
+def find_tuples(start, stop, seperator, serial_numbers, data_dir, out_file, max_offset, chunk_size, verify, index_dir):
+    if len(serial_numbers) < 2:
+        raise click.BadParameter('at least two serial numbers are required', param_hint='--serial_numbers')
+    start = datetime.strptime(start, '%Y-%m-%d %H:%M:%S.%f') 
+    stop = datetime.strptime(stop, '%Y-%m-%d %H:%M:%S.%f') 
+    serial_numbers = [int(s) for s in serial_numbers]
+    
+    t = time.time()
+    paths = _ImagePaths(data_dir, seperator, verify)
+    if index_dir:
+        chunks = frames.CaptureIndex(index_dir).frames(start, stop, serial_numbers)
+    else:
+        chunks = _fetch_frames(models.Session(), start, stop, serial_numbers, chunk_size)
+    matcher, counts, written = _write_matches(chunks, serial_numbers, paths, out_file, max_offset)
+    for serialNumber, m in zip(serial_numbers[1:], matcher.matchers):
+        print '{} frames of {}, {} backtracking mismatches'.format(counts[serialNumber], serialNumber, m.mismatches)
+    print '{} maximum possible tuples'.format(min(counts.values()))
+    print '{} tuples written to disk in {} seconds'.format(written, time.time() - t)
+    _report_missing(paths)
+    
+
+def _fetch_columns(session, start, stop, serial_numbers, chunk_size):
+    """
+    Streams all columns of the ImageMetadata rows in [start, stop) of 
+    serial_numbers, or of all cameras if there are none, in chunks of 
+    chunk_size rows ordered by creationTimeStamp. Each chunk is a list of 
+    int64 arrays, with timestamps in microseconds and NULL as columns.null.
+    """
+    table = models.ImageMetadata.__table__
+    creationTimeStamp = models.MicrosecondTimestamp.column_raw(table.c.creationTimeStamp)
+    query = select([creationTimeStamp if column.name == 'creationTimeStamp' else column for column in table.columns])
+    conditions = [utils.microseconds(start) <= creationTimeStamp, creationTimeStamp < utils.microseconds(stop)]
+    if serial_numbers:
+        conditions.append(table.c.serialNumber.in_(serial_numbers))
+    query = query.where(and_(*conditions)).order_by(table.c.creationTimeStamp)
+    result = session.execute(query.execution_options(stream_results=True))
+    null = columns.null
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield [np.array([null if value is None else value for value in values], np.int64) for values in zip(*rows)]
+        
+        
+@click.command()
+@click.option('--start', help='starting datetime formatted as %Y-%m-%d %H:%M:%S.%f', required=True)    
+@click.option('--stop', help='stopping datetime formatted as %Y-%m-%d %H:%M:%S.%f', required=True)    
+@click.option('--serial_numbers', help='serial number of a camera to export, repeated for each camera; defaults to all cameras', 
+              multiple=True)    
+@click.option('--out_file', help='output file name, or directory for npy, where the columns are written', required=True)    
+@click.option('--format', help='npy for a directory of memory mappable .npy files, uncompressed npz, or parquet if pyarrow is installed', 
+              type=click.Choice(sorted(columns.writers)), default='npz')    
+@click.option('--chunk_size', help='number of rows fetched from the database at a time', default=100000)    
+def export(start, stop, serial_numbers, out_file, format, chunk_size):
+    if format == 'parquet' and columns.pyarrow is None:
+        raise click.BadParameter('parquet requires pyarrow, which is not installed', param_hint='--format')
     session = models.Session()    
     start = datetime.strptime(start, '%Y-%m-%d %H:%M:%S.%f') 
     stop = datetime.strptime(stop, '%Y-%m-%d %H:%M:%S.%f') 
     serial_numbers = [int(s) for s in serial_numbers]
     
-    query = session.query(models.ImageMetadata.creationTimeStamp,
-                          models.ImageMetadata.serialNumber,
-                          models.ImageMetadata.frameNumber)
-    query = query.filter(start <= models.ImageMetadata.creationTimeStamp,
-                         models.ImageMetadata.creationTimeStamp < stop,
-                         models.ImageMetadata.serialNumber.in_(serial_numbers))
-    query = query.order_by(models.ImageMetadata.creationTimeStamp)
-    print '{} potential pairs selected'.format(query.count() / 2)
-    
-    timestamp_index = {}
-    frameNumber_index = {}
-    for instance in query: 
-        try:
-            timestamp_index[instance.serialNumber].append(instance.creationTimeStamp)
-        except KeyError:
-            timestamp_index[instance.serialNumber] = [instance.creationTimeStamp]
-        finally:
-            frameNumber_index[instance.serialNumber, instance.creationTimeStamp] = instance.frameNumber
-    print '{} maximum possible pairs'.format(min(len(v) for v in timestamp_index.values()))
-    
-    pairs = []
-    for timestamp in timestamp_index[serial_numbers[0]]:        
-        forward_match = utils.take_closest(timestamp_index[serial_numbers[1]], timestamp)
-        backward_match = utils.take_closest(timestamp_index[serial_numbers[0]], forward_match)        
-        if timestamp == backward_match:
-            im0 = seperator.join(map(str,
-                                     (timestamp.strftime('%Y%m%dT%H%M%S.%f'),
-                                      serial_numbers[0],
-                                      frameNumber_index[serial_numbers[0], timestamp]))) + '.jpg'
-            im0 = os.path.join(data_dir, timestamp.strftime('%Y%m%d'), timestamp.strftime('%H'), im0)
-            im1 = seperator.join(map(str,
-                                     (forward_match.strftime('%Y%m%dT%H%M%S.%f'),
-                                      serial_numbers[1],
-                                      frameNumber_index[serial_numbers[1], forward_match]))) + '.jpg'
-            im1 = os.path.join(data_dir, forward_match.strftime('%Y%m%d'), forward_match.strftime('%H'), im1)
-            if not (os.path.isfile(im0) and os.path.isfile(im1)):
-                warnings.warn('some computed image paths do not exist')
-            pairs.append([im0, im1])
-        else:
-            warnings.warn('some backtracking mismatches')    
+    t = time.time()
+    names = [column.name for column in models.ImageMetadata.__table__.columns]
+    with columns.writers[format](out_file, names) as writer:
+        for chunk in _fetch_columns(session, start, stop, serial_numbers, chunk_size):
+            writer.write(chunk)
+    print '{} rows of {} columns exported in {} seconds'.format(writer.rows, len(names), time.time() - t)
     
-    with open(out_file, 'w+') as fp:
-        writer = csv.writer(fp, lineterminator='\n')
-        writer.writerows(pairs)
-    print '{} pairs written to disk'.format(len(pairs))
+
+@click.command()
+@click.option('--data_dir', help='root directory where images and metadata were captured', required=True)
+@click.option('--index_dir', help='directory where the frame index is written and updated', required=True)
+def index(data_dir, index_dir):
+    t = time.time()
+    indexed, skipped = frames.CaptureIndex(index_dir).update(data_dir)
+    print '{} directories indexed, {} unchanged directories skipped in {} seconds'.format(indexed, skipped, time.time() - t)
     
 
 @click.group()
@@ -251,5 +978,8 @@ def cli():
         
 
 cli.add_command(find_pairs)
+cli.add_command(find_tuples)
+cli.add_command(export)
+cli.add_command(index)
 cli.add_command(populate_db)
                 
@@ -0,0 +1,207 @@
+import numpy as np
+
+
+def take_closest(seq, values):
+    """
+    Vectorized utils.take_closest. Assumes seq is sorted and returns, for 
+    each of values, the index of the closest element of seq.
+
+    If two elements are equally close, the index of the smaller one is returned.
+    """
+    seq, values = np.asarray(seq), np.asarray(values)
+    if len(seq) == 1:
+        return np.zeros(values.shape, np.intp)
+    pos = np.clip(np.searchsorted(seq, values, 'left'), 1, len(seq) - 1)
+    before, after = seq[pos - 1], seq[pos]
+    return np.where(after - values < values - before, pos, pos - 1)
+
+
+def match_pairs(t0, t1, max_offset=None):
+    """
+    Matches two sorted int64 timestamp arrays by mutual nearest neighbours: 
+    t0[i0] is the closest element of t0 to t1[i1] and vice versa. Pairs 
+    further apart than max_offset are dropped when it is given.
+    
+    Returns (i0, i1, mismatches) where mismatches counts the elements of t0 
+    whose nearest neighbour in t1 is closer to another element of t0.
+    """
+    t0, t1 = np.asarray(t0, np.int64), np.asarray(t1, np.int64)
+    if len(t0) == 0 or len(t1) == 0:
+        empty = np.zeros(0, np.intp)
+        return empty, empty, 0
+    forward = take_closest(t1, t0)
+    backward = take_closest(t0, t1[forward])
+    mutual = t0[backward] == t0
+    mismatches = len(t0) - np.count_nonzero(mutual)
+    if max_offset is not None:
+        mutual &= np.abs(t1[forward] - t0) <= max_offset
+    i0 = np.flatnonzero(mutual)
+    return i0, forward[i0], mismatches
+
+
+class StreamMatcher(object):
+    """
+    Incremental match_pairs for timestamps that arrive in ascending order 
+    in chunks, e.g. from a server side cursor. Each element of t0 is 
+    decided as soon as no later timestamp can change its match, and only 
+    the undecided tail plus one element of look-back is kept in memory.
+    
+    Aligned payload arrays (e.g. frame numbers) travel with the timestamps 
+    and are returned for the matched pairs. horizon is the latest element 
+    of t0 decided so far.
+    """
+    def __init__(self, max_offset=None):
+        self.max_offset = max_offset
+        self.mismatches = 0
+        self._t = [np.zeros(0, np.int64), np.zeros(0, np.int64)]
+        self._p = [np.zeros(0, object), np.zeros(0, object)]
+        self._start = 0
+        self.horizon = None
+        
+    def update(self, t0, t1, p0, p1):
+        """
+        Appends a chunk for each camera and returns the newly decided 
+        pairs as (t0, t1, p0, p1) arrays.
+        """
+        self._t = [np.concatenate((self._t[0], t0)), np.concatenate((self._t[1], t1))]
+        self._p = [np.concatenate((self._p[0], p0)), np.concatenate((self._p[1], p1))]
+        return self._match(False)
+    def finish(self):
+        'Decides and returns the remaining pairs once all chunks were added'
+        return self._match(True)
+    
+    def _match(self, final):
+        (t0, t1), (p0, p1), start = self._t, self._p, self._start
+        if final:
+            self.horizon = np.iinfo(np.int64).max
+        if len(t0) == start or len(t1) == 0:
+            empty = np.zeros(0, np.intp)
+            return t0[empty], t1[empty], p0[empty], p1[empty]
+        forward = take_closest(t1, t0[start:])
+        backward = take_closest(t0, t1[forward])
+        if final:
+            n = len(forward)
+        else:
+            # both conditions only turn from true to false along t0
+            ready = (t0[start:] <= t1[-1]) & (t1[forward] <= t0[-1])
+            n = len(ready) if ready.all() else int(np.argmin(ready))
+        i0 = start + np.arange(n)
+        mutual = t0[backward[:n]] == t0[i0]
+        self.mismatches += n - np.count_nonzero(mutual)
+        if self.max_offset is not None:
+            mutual &= np.abs(t1[forward[:n]] - t0[i0]) <= self.max_offset
+        i0, i1 = i0[mutual], forward[:n][mutual]
+        matched = t0[i0], t1[i1], p0[i0], p1[i1]
+        
+        # later elements of t0 only need their predecessor in t1 and, 
+        # to detect backtracking mismatches, the last decided element of t0
+        k = start + n
+        if k > 0 and not final:
+            self.horizon = t0[k - 1]
+        j = max(np.searchsorted(t1, t0[min(k, len(t0) - 1)], 'left') - 1, 0)
+        self._t = [t0[max(k - 1, 0):], t1[j:]]
+        self._p = [p0[max(k - 1, 0):], p1[j:]]
+        self._start = min(k, 1)
+        return matched
+
+
+class TupleMatcher(object):
+    """
+    Streams synchronized frames of n cameras: a frame of the first 
+    (reference) camera is kept when the frame of every other camera 
+    is its mutual nearest neighbour. Runs one StreamMatcher per other 
+    camera and merges their decided reference frames, so the cost is 
+    linear in the number of frames and cameras.
+    """
+    def __init__(self, n, max_offset=None):
+        self.matchers = [StreamMatcher(max_offset) for _ in xrange(n - 1)]
+        self._pending = [None] * (n - 1)
+        
+    def update(self, ts, ps):
+        """
+        Appends a chunk of timestamps ts and payloads ps for each camera 
+        and returns the newly decided tuples as (ts, ps) lists of arrays.
+        """
+        return self._join([m.update(ts[0], t, ps[0], p) for m, t, p in zip(self.matchers, ts[1:], ps[1:])])
+    def finish(self):
+        'Decides and returns the remaining tuples once all chunks were added'
+        return self._join([m.finish() for m in self.matchers])
+    
+    def _join(self, matched):
+        pending = [new if old is None else tuple(np.concatenate(v) for v in zip(old, new))
+                   for old, new in zip(self._pending, matched)]
+        horizons = [m.horizon for m in self.matchers]
+        if None in horizons:
+            ready = [0] * len(pending)
+        else:
+            ready = [np.searchsorted(t0, min(horizons), 'right') for t0, _, _, _ in pending]
+        common = reduce(np.intersect1d, [t0[:r] for (t0, _, _, _), r in zip(pending, ready)])
+        ts, ps = [common], [None]
+        for (t0, t, p0, p), r in zip(pending, ready):
+            mask = np.in1d(t0[:r], common, assume_unique=True)
+            ps[0] = p0[:r][mask]
+            ts.append(t[:r][mask])
+            ps.append(p[:r][mask])
+        self._pending = [tuple(v[r:] for v in values) for values, r in zip(pending, ready)]
+        return ts, ps
+
+
+def cycle_time_microseconds(values, host):
+    """
+    Converts IEEE 1394 cycle time stamps, as embedded by the cameras (7 bit 
+    seconds, 13 bit count of 125 microsecond cycles and 12 bit cycle offset), 
+    into int64 microseconds. The seconds wrap every 128 seconds, so the 
+    number of wraps since the first frame is taken from the host timestamps 
+    in microseconds of the same frames, which holds across capture pauses 
+    of any length as long as both clocks drift apart by less than 64 seconds.
+    """
+    values, host = np.asarray(values, np.int64), np.asarray(host, np.int64)
+    seconds, cycles, offsets = (values >> 25) & 0x7F, (values >> 12) & 0x1FFF, values & 0xFFF
+    microseconds = seconds * 10 ** 6 + cycles * 125 + offsets * 125 // 3072
+    if not len(microseconds):
+        return microseconds
+    period = 128 * 10 ** 6
+    # the cycle time lost in whole periods, rounded to the nearest one
+    lost = (host - host[0]) - (microseconds - microseconds[0])
+    return microseconds + (lost + period // 2) // period * period
+
+
+class ClockModel(object):
+    """
+    Linear model host = offset + slope * embedded of the host timestamps 
+    of a camera's frames against its embedded clock, both in microseconds. 
+    Host timestamps are delayed by scheduling, so the fit is repeated 
+    without frames whose residual exceeds threshold median absolute 
+    deviations. jitter is the residual standard deviation of the kept 
+    frames and drift the parts per million the embedded clock runs fast.
+    """
+    def __init__(self, host, embedded, threshold=3.0, iterations=3):
+        host, embedded = np.asarray(host, np.int64), np.asarray(embedded, np.int64)
+        self.host0 = host[0] if len(host) else 0
+        self.embedded0 = embedded[0] if len(embedded) else 0
+        # relative to the first frame so that float64 keeps microseconds
+        x, y = (embedded - self.embedded0).astype(np.float64), (host - self.host0).astype(np.float64)
+        self.slope, self.intercept, self.jitter = 1.0, 0.0, 0.0
+        self.inliers = len(x)
+        if len(x) < 2 or np.ptp(x) == 0:
+            return
+        keep = np.ones(len(x), bool)
+        for _ in xrange(iterations):
+            self.slope, self.intercept = np.polyfit(x[keep], y[keep], 1)
+            residuals = y - (self.intercept + self.slope * x)
+            center = np.median(residuals[keep])
+            mad = np.median(np.abs(residuals[keep] - center))
+            inliers = np.abs(residuals - center) <= threshold * max(mad, 1.0)
+            if (inliers == keep).all() or np.count_nonzero(inliers) < 2:
+                break
+            keep = inliers
+        self.jitter = float(np.std(residuals[keep]))
+        self.inliers = int(np.count_nonzero(keep))
+        
+    @property
+    def drift(self):
+        return (1 / self.slope - 1) * 10 ** 6
+    def __call__(self, embedded):
+        'Host timeline int64 microseconds of embedded timestamps'
+        x = (np.asarray(embedded, np.int64) - self.embedded0).astype(np.float64)
+        return self.host0 + np.round(self.intercept + self.slope * x).astype(np.int64)
@@ -0,0 +1,68 @@
+from psitres import models
+from lxml import etree
+import threading
+import warnings
+
+
+def _to_bool(text):
+    value = text.strip().lower()
+    if value in ('true', '1'):
+        return True
+    if value in ('false', '0'):
+        return False
+    raise ValueError('invalid boolean: {!r}'.format(text))
+
+
+def _converter(python_type):
+    if python_type is bool:
+        return _to_bool
+    if python_type in (str, unicode):
+        # lxml returns unicode for non-ascii text, which str() would not encode
+        return lambda text: text
+    return python_type
+
+
+converters = {modelName:{name:_converter(python_type) for name, python_type in schema.python_types.iteritems()}
+              for modelName, schema in models.schemas.iteritems()}
+_local = threading.local()
+
+
+def _parser():
+    'lxml parsers are reusable but not thread safe, so each thread keeps one'
+    try:
+        return _local.parser
+    except AttributeError:
+        _local.parser = etree.XMLParser(remove_blank_text=True, resolve_entities=False)
+        return _local.parser
+    
+    
+def parse(path, modelName):
+    """
+    Returns the column values of the modelName element in the metadata 
+    file at path. Elements without text become None and elements that 
+    are not columns of the model are skipped with a warning.
+    """
+    model_converters = converters[modelName]
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    try:
+        root_node = etree.fromstring(data, _parser())
+    except etree.XMLSyntaxError:
+        warnings.warn('unable to parse metadata for {}: {}'.format(modelName, path), RuntimeWarning, 2)
+        return {}
+    if root_node.tag != modelName:
+        root_node = root_node.find(modelName)
+        if root_node is None:
+            warnings.warn('no {} element in {}'.format(modelName, path), RuntimeWarning, 2)
+            return {}
+    
+    metadata = {}
+    for attribute in root_node:
+        try:
+            convert = model_converters[attribute.tag]
+        except KeyError:
+            warnings.warn('unknown {} element: {}'.format(modelName, attribute.tag), RuntimeWarning, 2)
+            continue
+        text = attribute.text
+        metadata[attribute.tag] = None if text is None or not text.strip() else convert(text)
+    return metadata
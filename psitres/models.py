@@ -1,8 +1,12 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import engine_from_config, TypeDecorator, Index, Column, BigInteger, Integer, String, Boolean, ForeignKey
+from sqlalchemy import engine_from_config, type_coerce, TypeDecorator, Index, Column, BigInteger, Integer, String, Boolean, ForeignKey
 from sqlalchemy.orm import sessionmaker, relationship, backref, scoped_session
 from sqlalchemy.inspection import inspect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateIndex
+from psitres import utils
 from datetime import datetime, timedelta
+from collections import namedtuple
 import ast
 
 
@@ -13,12 +17,44 @@ Base = declarative_base(bind=engine)
 Session = scoped_session(sessionmaker(bind=engine))
 
 
+@compiles(CreateIndex, 'sqlite')
+def _create_sqlite_index(create, compiler, **kw):
+    'SQLite index names are database wide, so they are qualified with the table name there'
+    index = create.element
+    name = compiler.preparer.format_index(index)
+    qualified = compiler.preparer.quote('{}_{}'.format(index.table.name, index.name))
+    return compiler.visit_create_index(create, **kw).replace(name, qualified, 1)
+
+
 class MicrosecondTimestamp(TypeDecorator):
+    """
+    datetime stored as integer microseconds since the epoch, converted with 
+    exact integer arithmetic. Integers are bound as they are and, with raw, 
+    results are returned as integers without building datetimes.
+    """
     impl = BigInteger
-    epoch = datetime(1970, 1, 1)
+    epoch = utils.epoch
+    def __init__(self, raw=False):
+        super(MicrosecondTimestamp, self).__init__()
+        self.raw = raw
+    @classmethod
+    def column_raw(cls, column):
+        'column selected as integer microseconds, for bulk readers'
+        return type_coerce(column, cls(raw=True))
+        
     def process_bind_param(self, value, dialect):
-        return long((value - self.epoch).total_seconds() * 10 ** 6)
+        if value is None or type(value) in (int, long):
+            return value
+        delta = value - self.epoch
+        return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    def result_processor(self, dialect, coltype):
+        if self.raw:
+            return self.impl.result_processor(dialect, coltype)
+        return super(MicrosecondTimestamp, self).result_processor(dialect, coltype)
     def process_result_value(self, value, dialect):
+        if value is None:
+            return value
+        # exact for integers, unlike the float seconds of total_seconds
         return self.epoch + timedelta(microseconds=value)
 
 
@@ -103,6 +139,7 @@ class ImageMetadata(Base):
     __tablename__ = 'ImageMetadata'
     __table_args__ = (
             Index('creationTimeStamp_serialNumber', 'creationTimeStamp', 'serialNumber', unique=True),
+            Index('serialNumber_creationTimeStamp_frameNumber', 'serialNumber', 'creationTimeStamp', 'frameNumber'),
             {'mysql_engine':'InnoDB'},
             )
     
@@ -131,8 +168,150 @@ class ImageMetadata(Base):
     SystemInfo = relationship(SystemInfo, backref=backref('ImageMetadatas'))
     
     
-def recreate():
+class IngestLedger(Base):
+    __tablename__ = 'IngestLedger'
+    __table_args__ = (
+            Index('directory', 'directory', unique=True),
+            {'mysql_engine':'InnoDB'},
+            )
+    
+    id = Column(Integer, primary_key=True)
+    directory = Column(String(255))
+    fileCount = Column(Integer)
+    maxMTime = Column(BigInteger)
+    status = Column(String(16))
+    
+    
+class StereoRig(Base):
+    __tablename__ = 'StereoRig'
+    __table_args__ = (
+            Index('serialNumber0_serialNumber1', 'serialNumber0', 'serialNumber1', unique=True),
+            {'mysql_engine':'InnoDB'},
+            )
+    
+    id = Column(Integer, primary_key=True)
+    serialNumber0 = Column(Integer)
+    serialNumber1 = Column(Integer)
+    
+    
+class StereoPair(Base):
+    """
+    Materialized find_pairs matches of a StereoRig. creationTimeStamp is 
+    that of the frame of serialNumber0 and offset the microseconds from 
+    it to the frame of serialNumber1. The ImageMetadata ids are not foreign 
+    keys since InnoDB does not allow them to reference a partitioned table.
+    """
+    __tablename__ = 'StereoPair'
+    __table_args__ = (
+            Index('StereoRig_id_creationTimeStamp', 'StereoRig_id', 'creationTimeStamp'),
+            {'mysql_engine':'InnoDB'},
+            )
+    
+    id = Column(Integer, primary_key=True)
+    creationTimeStamp = Column(MicrosecondTimestamp)
+    offset = Column(BigInteger)
+    
+    StereoRig_id = Column(Integer, ForeignKey(StereoRig.id))
+    ImageMetadata0_id = Column(Integer)
+    ImageMetadata1_id = Column(Integer)
+    
+    StereoRig = relationship(StereoRig, backref=backref('StereoPairs'))
+    
+    
+class StereoPairLedger(Base):
+    """
+    Hour directories whose frames have been matched into the StereoPairs 
+    of a StereoRig, by the creationTimeStamp at which the hour starts.
+    """
+    __tablename__ = 'StereoPairLedger'
+    __table_args__ = (
+            Index('StereoRig_id_creationTimeStamp', 'StereoRig_id', 'creationTimeStamp', unique=True),
+            {'mysql_engine':'InnoDB'},
+            )
+    
+    id = Column(Integer, primary_key=True)
+    creationTimeStamp = Column(MicrosecondTimestamp)
+    
+    StereoRig_id = Column(Integer, ForeignKey(StereoRig.id))
+    
+    
+ModelSchema = namedtuple('ModelSchema', ['model', 'unique_index', 'foreign_keys', 'python_types'])
+
+
+def _model_schema(model):
+    """
+    Resolves the ingest relevant parts of a model from its declarative 
+    table, without reflecting the live database.
+    """
+    table = model.__table__
+    index = [index for index in table.indexes if index.name == 'creationTimeStamp_serialNumber']
+    if len(index) != 1:
+        raise ValueError('index creationTimeStamp_serialNumber does not exist in table {}'.format(table.name))
+    unique_index = tuple(column.name for column in index[0].columns)
+    
+    foreign_keys = []
+    for constraint in table.foreign_key_constraints:
+        if len(constraint.elements) != 1:
+            raise ValueError('composite foreign keys are not supported')
+        fk, = constraint.elements
+        foreign_keys.append((fk.parent.name, fk.column.table.name, fk.column.name))
+    
+    python_types = {}
+    for column in table.columns:
+        try:
+            python_types[column.name] = column.type.python_type
+        except NotImplementedError:
+            pass
+    return ModelSchema(model, unique_index, tuple(sorted(foreign_keys)), python_types)
+
+
+schemas = {model.__name__:_model_schema(model) for model in (CameraInfo, FC2Version, SystemInfo, ImageMetadata)}
+    
+    
+def partition_by_day(first_day, last_day):
+    """
+    Range partitions ImageMetadata on MySQL by creationTimeStamp, with one 
+    partition per day from first_day to last_day and one for later rows.
+    
+    InnoDB neither allows foreign keys on partitioned tables nor unique 
+    keys without the partitioning column, so the foreign key constraints 
+    are dropped (the ORM relationships are unaffected) and the primary key 
+    becomes (id, creationTimeStamp).
+    """
+    if engine.dialect.name != 'mysql':
+        raise ValueError('partitioning is only supported on MySQL')
+    table = ImageMetadata.__tablename__
+    alterations = ['DROP FOREIGN KEY `{}`'.format(fk['name']) for fk in inspect(engine).get_foreign_keys(table)]
+    alterations.append('DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `creationTimeStamp`)')
+    
+    partitions = []
+    day = datetime(first_day.year, first_day.month, first_day.day)
+    while day <= last_day:
+        partitions.append('PARTITION p{} VALUES LESS THAN ({})'.format(day.strftime('%Y%m%d'), 
+                                                                       utils.microseconds(day + timedelta(days=1))))
+        day += timedelta(days=1)
+    partitions.append('PARTITION pmax VALUES LESS THAN MAXVALUE')
+    
+    with engine.begin() as connection:
+        connection.execute('ALTER TABLE `{}` {}'.format(table, ', '.join(alterations)))
+        connection.execute('ALTER TABLE `{}` PARTITION BY RANGE (`creationTimeStamp`) ({})'.format(table, ', '.join(partitions)))
+    
+    
+def create_missing(*models):
+    """
+    Creates the tables of models that do not exist yet, such as those added 
+    after a database was created, without touching existing tables.
+    """
+    Base.metadata.create_all(engine, tables=[model.__table__ for model in models])
+    
+    
+def recreate(partition_days=None):
+    # checked before anything is dropped
+    if partition_days and engine.dialect.name != 'mysql':
+        raise ValueError('partitioning is only supported on MySQL')
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
+    if partition_days:
+        partition_by_day(*partition_days)
     
     
\ No newline at end of file
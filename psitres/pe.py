@@ -2,6 +2,8 @@ from __future__ import print_function
 import traceback
 import multiprocessing as mp
 import threading
+import Queue
+import sys
 from joblib import delayed
 
 
@@ -47,14 +49,34 @@ def mp_print(*args, **kwargs):
     
     
 class ParFor(object):
+    """
+    Maps over a process pool created per call or, when used as a context 
+    manager, over one pool kept for the whole with block. Local objects 
+    that exist when a pool is created are shipped to its processes once.
+    """
     def __init__(self, processes=None, initializer=None, initargs=(), maxtasksperchild=None):
         self._args = processes, initializer, initargs, maxtasksperchild
+        self._pool = None
+    def __enter__(self):
+        self._pool = self._new_pool()
+        return self
+    def __exit__(self, exc_type, exc_value, tb):
+        pool, self._pool = self._pool, None
+        if exc_type is None:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+    def _new_pool(self):
+        processes, initializer, initargs, maxtasksperchild = self._args
+        initializer, initargs = _initializer, (initializer, initargs, Local._items())
+        return mp.Pool(processes, initializer, initargs, maxtasksperchild)
     def __call__(self, iterable):
         if not hasattr(iterable, '__len__'):
             iterable = tuple(iterable)
-        processes, initializer, initargs, maxtasksperchild = self._args
-        initializer, initargs = _initializer, (initializer, initargs, Local._items())
-        pool = mp.Pool(processes, initializer, initargs, maxtasksperchild)        
+        if self._pool is not None:
+            return self._pool.map(_worker, iterable)
+        pool = self._new_pool()
         try:
             r = pool.map(_worker, iterable)
             pool.close()
@@ -64,8 +86,88 @@ class ParFor(object):
             raise
         finally:
             pool.join()
+    def imap_unordered(self, iterable, maxsize=None):
+        """
+        Yields results in completion order, consuming iterable lazily so 
+        that at most maxsize tasks are queued or running at any time.
+        """
+        if maxsize is None:
+            maxsize = 2 * (self._args[0] or mp.cpu_count())
+        slots, stop = threading.Semaphore(maxsize), threading.Event()
+        def bounded():
+            for item in iterable:
+                slots.acquire()
+                if stop.is_set():
+                    return
+                yield item
+        pool = self._pool or self._new_pool()
+        try:
+            for r in pool.imap_unordered(_worker, bounded()):
+                slots.release()
+                yield r
+            if pool is not self._pool:
+                pool.close()
+        except:
+            # unblock the task feeder so that it stops or terminate can join it
+            stop.set()
+            slots.release()
+            if pool is not self._pool:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not self._pool:
+                pool.join()
             
             
+def prefetch(iterable, depth):
+    """
+    Iterates over iterable in a background thread that stays at most depth 
+    items ahead of the consumer, so that producing the next items, e.g. 
+    reading and parsing files, overlaps with consuming the current one. 
+    Exceptions of the producer are raised in the consumer.
+    """
+    if depth < 1:
+        return iter(iterable)
+    return _prefetch(iterable, depth)
+
+
+def _prefetch(iterable, depth):
+    queue, stop = Queue.Queue(depth), threading.Event()
+    def put(item):
+        # gives up once the consumer stopped, which then no longer takes items
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except:
+            put((False, sys.exc_info()))
+        else:
+            put((False, None))
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            ok, item = queue.get()
+            if ok:
+                yield item
+            elif item is None:
+                return
+            else:
+                raise item[0], item[1], item[2]
+    finally:
+        stop.set()
+        thread.join()
+        
+        
 class Local(object):
     _nmspc = _Namespace()
     _lck = threading.RLock()
@@ -0,0 +1,87 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from multiprocessing import util
+import cProfile
+import functools
+import multiprocessing as mp
+import os
+import threading
+import time
+
+
+class Stages(object):
+    """
+    Wall clock seconds and item counts per named stage. Each process 
+    collects its own; worker processes drain theirs after every task 
+    and the parent merges what they return.
+    """
+    def __init__(self):
+        self._lck = threading.Lock()
+        self._seconds = defaultdict(float)
+        self._counts = defaultdict(int)
+        
+    @contextmanager
+    def __call__(self, name, count=1):
+        t = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - t, count)
+    def add(self, name, seconds, count=1):
+        with self._lck:
+            self._seconds[name] += seconds
+            self._counts[name] += count
+    def timed(self, name):
+        'Decorator timing every call of a function under name'
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                with self(name):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+    def iterate(self, name, iterable):
+        'Yields the items of iterable, timing each step under name'
+        iterator = iter(iterable)
+        while True:
+            t = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.time() - t, 0)
+                return
+            self.add(name, time.time() - t)
+            yield item
+            
+    def drain(self):
+        'Returns {name: (seconds, count)} collected so far and resets'
+        with self._lck:
+            drained = {name:(seconds, self._counts[name]) for name, seconds in self._seconds.iteritems()}
+            self._seconds.clear()
+            self._counts.clear()
+        return drained
+    def merge(self, drained):
+        for name, (seconds, count) in drained.iteritems():
+            self.add(name, seconds, count)
+    def to_dict(self):
+        with self._lck:
+            return {name:{'seconds':seconds, 'count':self._counts[name]} for name, seconds in self._seconds.iteritems()}
+        
+        
+stages = Stages()
+
+
+def profile(profile_dir, name):
+    """
+    Runs cProfile in the calling process until it exits and then dumps the 
+    stats to profile_dir/name.<pid>.prof. Dumped at exit by a multiprocessing 
+    finalizer so that it also works in pool processes that exit normally.
+    """
+    profiler = cProfile.Profile()
+    path = os.path.join(profile_dir, '{}.{}.prof'.format(name, mp.current_process().ident))
+    def dump():
+        profiler.disable()
+        profiler.dump_stats(path)
+    util.Finalize(None, dump, exitpriority=100)
+    profiler.enable()
+    return profiler
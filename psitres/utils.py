@@ -1,6 +1,25 @@
 from sqlalchemy.orm.exc import NoResultFound
+from datetime import datetime, timedelta
 import bisect
 import math
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+
+epoch = datetime(1970, 1, 1)
+
+
+def microseconds(value):
+    'Exact integer microseconds between the unix epoch and datetime value'
+    delta = value - epoch
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
+def from_microseconds(value):
+    'Inverse of microseconds'
+    return epoch + timedelta(microseconds=int(value))
 
 
 def binary_search(a, x):
@@ -31,6 +50,21 @@ def partition(seq, n):
     return (seq[i:i + n] for i in xrange(0, len(seq), n))
 
 
+def batches(iterable, n):
+    """
+    Yield successive lists of n items from iterable, 
+    the last one possibly shorter.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+        
+        
 def take_closest(seq, n):
     """
     Assumes seq is sorted. Returns closest value to n.